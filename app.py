@@ -8,9 +8,10 @@
 
 
 from c19mining.sedesa import XMLParser
-from c19mining.covid import MedNotesMiner
 from c19mining.report import ReportGenerator, AmchartsGenerator
 from c19mining.ocr import TesseOCR
+from c19mining.sinks import JSONFileSink, JSONLinesSink, SQLiteSink
+from c19mining.cache import MiningCache
 from c19mining.utils import (uploads_dir, allowed_file, allowed_xml_file, log_file,
                              admissions_dir, discharges_dir, extractions_dir,
                              amcharts_dir, excels_dir, get_time)
@@ -24,6 +25,7 @@ import urllib.request
 from werkzeug.utils import secure_filename
 from flask import Flask, request, jsonify, redirect, render_template, abort
 import threading
+from datetime import datetime
 from glob import glob
 
 
@@ -35,10 +37,22 @@ app.config['JSON_AS_ASCII'] = False
 app.config['XMLS_INGRESOS'] = admissions_dir()
 app.config['XMLS_EGRESOS'] = discharges_dir()
 app.config['EXTRACTIONS_DATA'] = extractions_dir()
+app.config['EXTRACTIONS_CHECKPOINT'] = join(extractions_dir(), 'checkpoint.tsv')
+# clues of every note mined, shared by uploads and /covid19 requests
+app.config['MINING_CACHE'] = join(extractions_dir(), 'cache.sqlite')
+app.config['MINING_CACHE_SIZE'] = int(os.environ.get('MINING_CACHE_SIZE', 4096))
+app.config['REPORT_STATE'] = join(excels_dir(), 'reporte.npz')
 app.config['AMCHARTS_DATA'] = amcharts_dir()
 app.config['EXCEL_DATA'] = excels_dir()
 app.config['UPLOAD_FOLDER'] = uploads_dir()
+# processes used to mine notes, all cores by default
+app.config['MINING_WORKERS'] = int(os.environ.get('MINING_WORKERS', os.cpu_count()))
+# 'json' for one file per note, 'jsonl' for gzip JSON lines shards,
+# 'sqlite' for the indexed store of every upload
+app.config['EXTRACTIONS_FORMAT'] = os.environ.get('EXTRACTIONS_FORMAT', 'json')
+app.config['EXTRACTIONS_STORE'] = join(extractions_dir(), 'extracciones.sqlite')
 my_ocr = TesseOCR(LANGUAGE)
+mining_cache = MiningCache(app.config['MINING_CACHE_SIZE'], app.config['MINING_CACHE'])
 
 
 @app.route('/ingresos', methods=['POST'])
@@ -112,9 +126,20 @@ def textmining():
     xmlparser = XMLParser(admissions_xml)
     thread_name ='Thread-covid_{}'.format(datestamp)
     extractions_dir = join(app.config['EXTRACTIONS_DATA'], datestamp)
+    if app.config['EXTRACTIONS_FORMAT'] == 'jsonl':
+        sink = JSONLinesSink(extractions_dir, compress=True, texts='external')
+    elif app.config['EXTRACTIONS_FORMAT'] == 'sqlite':
+        extractions_dir = app.config['EXTRACTIONS_STORE']
+        sink = SQLiteSink(extractions_dir)
+    else:
+        sink = JSONFileSink(extractions_dir)
+    # records mined by earlier uploads are not mined again
     task_thread = threading.Thread(target=xmlparser.covid_extraction,
         name='Thread-covid_{}'.format(datestamp),
-        kwargs={'outputdir': extractions_dir})
+        kwargs={'sink': sink,
+                'workers': app.config['MINING_WORKERS'],
+                'checkpoint': app.config['EXTRACTIONS_CHECKPOINT'],
+                'cache': mining_cache})
     task_thread.start()
     # success
     resp = jsonify({'thread' : thread_name,
@@ -124,18 +149,43 @@ def textmining():
 
 @app.route('/reporte', methods=['POST'])
 def build_report():
+    """Excel report and chart data of every extraction so far.
+
+    The report covers all the datestamp directories under EXTRACTIONS_DATA,
+    or the whole store with EXTRACTIONS_FORMAT=sqlite, not only today's
+    upload: with the checkpoint an upload only mines the records no earlier
+    upload mined. Other files kept there (checkpoint.tsv, cache.sqlite) are
+    not extractions and are skipped. ?desde=&hasta= (YYYY-MM-DD) narrow it
+    to the notes admitted in those days.
+    """
     datestamp = get_time()
-    report = ReportGenerator(mednotes_dir=join(app.config['EXTRACTIONS_DATA'], datestamp),
+    # admission days of the report, /reporte?desde=2020-03-01&hasta=2020-05-31
+    try:
+        (desde, hasta) = (datetime.strptime(request.args[arg], '%Y-%m-%d') if arg in request.args else None
+                          for arg in ('desde', 'hasta'))
+    except ValueError:
+        resp = jsonify({'message' : 'desde and hasta must be dates like 2020-03-31'})
+        resp.status_code = 400
+        return resp
+    # every upload only stores its new records, the report reads them all
+    # but only the extractions added since the last report are read again
+    if app.config['EXTRACTIONS_FORMAT'] == 'sqlite':
+        mednotes = app.config['EXTRACTIONS_STORE']
+    else:
+        mednotes = app.config['EXTRACTIONS_DATA']
+    report = ReportGenerator(mednotes_dir=mednotes,
                              excels_dir=join(app.config['EXCEL_DATA'], datestamp),
-                             only_covid=True)
-    report.to_excel()
+                             only_covid=True,
+                             state_path=app.config['REPORT_STATE'],
+                             desde=desde, hasta=hasta)
+    excel_path = report.to_excel()
     logging.info('Writen excel report OK')
     # data creation for charts
     chart_dir = join(app.config['AMCHARTS_DATA'], datestamp)
     amchart_gen = AmchartsGenerator()
-    am_symptoms = amchart_gen.pictorial_stacked_chart(report.df_symptoms, 10)
+    am_symptoms = amchart_gen.pictorial_stacked_chart(report.symptom_counts(), 10)
     logging.info(am_symptoms)
-    am_comorbs = amchart_gen.pictorial_stacked_chart(report.df_comorbs, 10)
+    am_comorbs = amchart_gen.pictorial_stacked_chart(report.comorbidity_counts(), 10)
     logging.info(am_comorbs)
     # admissions and discharges
     admissions_xml = find_xml(app.config['XMLS_INGRESOS'], datestamp)
@@ -147,14 +197,14 @@ def build_report():
     xml_discharges = XMLParser(discharges_xml)
     discharges_stamps = xml_discharges.datestamps()
     #logging.info(discharges_stamps)
-    am_pyramid = amchart_gen.population_pyramid(admissions_stamps, discharges_stamps)
+    am_pyramid = amchart_gen.population_pyramid(admissions_stamps, discharges_stamps, desde, hasta)
     logging.info(am_pyramid)
     # store data for charts
     symp_path = write_chart_data(am_symptoms, chart_dir, 'am_symptoms.JSON')
     comorbs_path = write_chart_data(am_comorbs, chart_dir, 'am_comorbs.JSON')
     pyramid_path = write_chart_data(am_pyramid, chart_dir, 'am_pyramid.JSON')
     # DONE!
-    resp = jsonify({'excel' : join(app.config['EXCEL_DATA'], datestamp, 'informe_de_covid_'+datestamp+'.xlsx'),
+    resp = jsonify({'excel' : excel_path,
                     'symptoms' : symp_path,
                     'comorbs' : comorbs_path,
                     'ingresos_egresos': pyramid_path
@@ -203,21 +253,21 @@ def covid19():
         abort(500)
 
     # symptoms stage
-    covid_seeker = MedNotesMiner(text)
     try:
-        covid_seeker.check_covid19()
-        covid_seeker.check_symptoms()
-        covid_seeker.check_sampling()
-        covid_seeker.check_decease()
-        covid_seeker.check_comorbidities()
-        covid_seeker.check_drugs()
-        json_resp =  json.dumps(covid_seeker.clues, ensure_ascii=False, encoding='utf-8', indent=2)
+        clues = mining_cache.mine(text)
+        json_resp =  json.dumps(clues, ensure_ascii=False, encoding='utf-8', indent=2)
         logging.info('Text Mining OK')
         return(json_resp)
     except Exception as e:
         logging.info(e)
         abort(500)
 
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    resp = jsonify(mining_cache.stats())
+    resp.status_code = 200
+    return resp
+
 def upload_check(request):
     logging.info('Uploading xml ...')
     if 'file' not in request.files:
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Notes per second of MedNotesMiner.mine_batch for 1, 2, 4 ... workers on
+# N copies of the test note, e.g.
+#
+#   python benchmarks/batch_bench.py 500
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from c19mining.utils import (HOME, TEST_TEXT)
+from c19mining.covid import MedNotesMiner
+from os.path import join
+import time
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with open(join(HOME, TEST_TEXT)) as f:
+        text = f.read()
+    notes = [(text, {'NHC': n}) for n in range(size)]
+    workers = 1
+    while workers <= os.cpu_count():
+        start = time.perf_counter()
+        for clues in MedNotesMiner.mine_batch(notes, workers=workers):
+            pass
+        elapsed = time.perf_counter() - start
+        print('{:3d} workers: {:8.1f} notes/s'.format(workers, size / elapsed))
+        workers *= 2
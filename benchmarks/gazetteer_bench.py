@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Compare the context regexes built by csv2contextregex with the token
+# gazetteer on the test note repeated N times, e.g.
+#
+#   python benchmarks/gazetteer_bench.py 50
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from c19mining.utils import (HOME, TEST_TEXT, COVID19_DATA, WIKI_SYMPTOMS_DATA,
+                             COVID19_MORBIDITIES_DATA, DRUGS_DATA,
+                             csv2contextregex, csv2gazetteer)
+from os.path import join
+import time
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (result, time.perf_counter() - start)
+
+def bench(resource, text):
+    path = join(HOME, resource)
+    regex, regex_build = timed(csv2contextregex, path)
+    gazetteer, gazetteer_build = timed(csv2gazetteer, path)
+    regex_hits, regex_scan = timed(lambda: len(list(regex.finditer(text))))
+    gazetteer_hits, gazetteer_scan = timed(lambda: len(list(gazetteer.finditer(text))))
+    print('{:<36} build {:8.4f}s / {:8.4f}s  scan {:8.4f}s / {:8.4f}s  '
+          'x{:6.1f}  hits {} / {}'.format(
+        resource, regex_build, gazetteer_build, regex_scan, gazetteer_scan,
+        regex_scan / gazetteer_scan, regex_hits, gazetteer_hits))
+
+
+if __name__ == '__main__':
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(join(HOME, TEST_TEXT)) as f:
+        text = f.read().lower() * scale
+    print('{} chars, regex / gazetteer'.format(len(text)))
+    for resource in [COVID19_DATA, WIKI_SYMPTOMS_DATA,
+                     COVID19_MORBIDITIES_DATA, DRUGS_DATA]:
+        bench(resource, text)
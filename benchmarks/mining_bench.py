@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Time the six check_* scans against one extract_all scan on the test note
+# repeated N times, e.g.
+#
+#   python benchmarks/mining_bench.py 50
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from c19mining.utils import (HOME, TEST_TEXT)
+from c19mining.covid import MedNotesMiner
+from os.path import join
+import time
+
+
+def check_each(miner):
+    miner.check_covid19()
+    miner.check_symptoms()
+    miner.check_sampling()
+    miner.check_decease()
+    miner.check_comorbidities()
+    miner.check_drugs()
+
+def timed(function, miner, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(miner)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(join(HOME, TEST_TEXT)) as f:
+        text = f.read() * scale
+    miner = MedNotesMiner(text)
+    each = timed(check_each, miner)
+    single = timed(MedNotesMiner.extract_all, miner)
+    print('{} chars: check_* {:.4f}s  extract_all {:.4f}s  x{:.1f}'.format(
+        len(text), each, single, each / single))
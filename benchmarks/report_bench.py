@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Seconds and peak memory of ReportGenerator over N copies of the clues of
+# the test note stored as JSON lines, e.g.
+#
+#   python benchmarks/report_bench.py 20000
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from c19mining.utils import (HOME, TEST_TEXT)
+from c19mining.covid import MedNotesMiner
+from c19mining.sinks import JSONLinesSink
+from c19mining.report import ReportGenerator
+from os.path import join
+import tempfile
+import time
+import tracemalloc
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with open(join(HOME, TEST_TEXT)) as f:
+        text = f.read()
+    init_data = {'Nombre': 'ALEX', 'Apellido Paterno': 'MOLINA',
+                 'Apellido Materno': 'VILLEGAS'}
+    clues = MedNotesMiner(text, dict(init_data)).extract_all()
+    with tempfile.TemporaryDirectory() as mednotes_dir:
+        with JSONLinesSink(mednotes_dir, texts='drop') as sink:
+            for n in range(size):
+                clues.update({'NHC': str(n), 'Fecha de Ingreso': '30/03/20 15:46:20'})
+                sink.write(clues)
+        tracemalloc.start()
+        start = time.perf_counter()
+        report = ReportGenerator(mednotes_dir, excels_dir=mednotes_dir)
+        elapsed = time.perf_counter() - start
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print('{} notes: {:.2f} s, peak {:.1f} MB'.format(len(report.df_report), elapsed, peak / 2**20))
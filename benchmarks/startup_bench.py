@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Cold start of a fresh interpreter: time to import c19mining.covid and time
+# to the first extraction, best of N runs, e.g.
+#
+#   python benchmarks/startup_bench.py 5
+
+import sys
+import subprocess
+from os.path import (dirname, abspath)
+
+HOME = dirname(dirname(abspath(__file__)))
+
+IMPORT = '''
+import time
+start = time.perf_counter()
+import c19mining.covid
+print(time.perf_counter() - start)
+'''
+
+FIRST_EXTRACTION = '''
+import time
+start = time.perf_counter()
+from c19mining.covid import MedNotesMiner
+MedNotesMiner('paciente con fiebre y tos, caso sospechoso de covid-19').extract_all()
+print(time.perf_counter() - start)
+'''
+
+def best_of(code, runs):
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], cwd=HOME, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True)
+        timings.append(float(out.stdout.strip()))
+    return min(timings)
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('import c19mining.covid  {:.4f}s'.format(best_of(IMPORT, runs)))
+    print('first extraction        {:.4f}s'.format(best_of(FIRST_EXTRACTION, runs)))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Time Tokenizer.split_tokens against NLTK word_tokenize (when NLTK is
+# installed) on the test note repeated N times, e.g.
+#
+#   python benchmarks/tokenizer_bench.py 50
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from c19mining.utils import (HOME, TEST_TEXT)
+from c19mining.textprocessing import Tokenizer
+from os.path import join
+import time
+
+
+def nltk_split_tokens(text):
+    """the former NLTK based Tokenizer.split_tokens"""
+    from nltk import word_tokenize
+    try:
+        word_tokenize('prueba')
+    except LookupError:
+        # punkt models are not installed, tokenize without sentence splitting
+        from nltk.tokenize import NLTKWordTokenizer
+        word_tokenize = NLTKWordTokenizer().tokenize
+    tokens = ''
+    for line in text.split('\n'):
+        tokens += '{}\n'.format(' '.join(word_tokenize(line)))
+    return tokens
+
+def timed(function, text):
+    start = time.perf_counter()
+    function(text)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(join(HOME, TEST_TEXT)) as f:
+        text = f.read().lower() * scale
+    fast = timed(Tokenizer().split_tokens, text)
+    print('{} chars: split_tokens {:.4f}s'.format(len(text), fast))
+    try:
+        slow = timed(nltk_split_tokens, text)
+    except ImportError:
+        print('NLTK is not installed')
+    else:
+        print('NLTK word_tokenize {:.4f}s  x{:.1f}'.format(slow, slow / fast))
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Memoization of MedNotesMiner. The same note comes back again and again
+# (repeated rows of daily exports, uploads of the same PDF), its clues are
+# looked up by the hash of the note instead of mining it again.
+
+import sys
+import os
+from os.path import (join, dirname, exists)
+sys.path.append(join(dirname(__file__), ".", ".."))
+
+from c19mining.covid import (MedNotesMiner, init_worker)
+from c19mining.textprocessing import Tokenizer
+from c19mining.utils import (CLUE_CATEGORIES, lexicon_registry, pool_imap)
+import hashlib
+import sqlite3
+import threading
+import time
+import simplejson as json
+from collections import (OrderedDict, deque)
+from concurrent.futures import Future
+
+
+class MiningCache(object):
+    """Clues of the notes already mined, keyed by note and lexicons.
+
+    The last size notes live in memory. With a path they are also stored in
+    a SQLite database, shared by every process and kept across restarts.
+    Only the very same note gets cached clues back, the contexts of the
+    mentions are slices of it.
+    """
+    def __init__(self, size=4096, path=None, lexicons=None):
+        super(MiningCache, self).__init__()
+        self.size = size
+        self.path = path
+        self.lexicons = lexicons if lexicons else lexicon_registry()
+        self.lock = threading.RLock()
+        self.memory = OrderedDict()
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0
+
+    def key(self, text, context_size=5, sections=None, version=None):
+        """hash of the note, the mining options and the lexicons version,
+        pass version to look it up once for many notes"""
+        version = version if version else self.lexicons.version()
+        options = '{}|{}|{}|'.format(version, context_size, sections)
+        return hashlib.blake2b((options+Tokenizer().read_text(text)).encode('utf-8'),
+                               digest_size=16).hexdigest()
+
+    def database(self):
+        """SQLite connection of this process, None without a path"""
+        if self.path is None:
+            return None
+        if self.connection is None or self.connection[0] != os.getpid():
+            directory = dirname(self.path)
+            if directory and not exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS clues ('
+                               'key TEXT PRIMARY KEY, clues TEXT NOT NULL, '
+                               'seconds REAL NOT NULL)')
+            self.connection = (os.getpid(), connection)
+        return self.connection[1]
+
+    def get(self, key, text, init_data=None):
+        """the clues of a note as MedNotesMiner gives them, None if the
+        note was never mined"""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+            else:
+                database = self.database()
+                if database is not None:
+                    entry = database.execute('SELECT clues, seconds FROM clues WHERE key = ?',
+                                             (key,)).fetchone()
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self.remember(key, tuple(entry))
+            self.hits += 1
+            self.saved += entry[1]
+        return self.restore(entry, text, init_data)
+
+    def restore(self, entry, text, init_data=None):
+        """the clues of a note from its cache entry"""
+        clues = init_data if init_data else dict()
+        clues['texto'] = text
+        clues.update(json.loads(entry[0]))
+        return clues
+
+    def put(self, key, clues, seconds):
+        """store the clues of a note that took seconds to mine, return
+        its cache entry"""
+        # only the clues that depend on the note, the rest comes from init_data
+        entry = (json.dumps({k: clues[k] for k in CLUE_CATEGORIES if k in clues},
+                            ensure_ascii=False), seconds)
+        with self.lock:
+            self.remember(key, entry)
+            database = self.database()
+            if database is not None:
+                with database:
+                    database.execute('INSERT OR REPLACE INTO clues VALUES (?, ?, ?)',
+                                     (key,) + entry)
+        return entry
+
+    def remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def mine(self, text, init_data=None, context_size=5, sections=None):
+        """the clues of a note, mined only if they are not cached"""
+        key = self.key(text, context_size, sections)
+        clues = self.get(key, text, init_data)
+        if clues is None:
+            (clues, seconds) = mine_timed(text, init_data, context_size, sections)
+            self.put(key, clues, seconds)
+        return clues
+
+    def mine_batch(self, notes, workers=None, max_pending=None, context_size=5,
+                   return_exceptions=False):
+        """MedNotesMiner.mine_batch that only sends the notes not cached to
+        the pool, cached notes keep their place in the output. A note
+        repeated in the batch is mined once, its copies wait for it."""
+        # (key, sent to the pool) of every note, in order
+        keys = deque()
+        # key: [(future, text, init_data)] of the copies of a note in the pool
+        copies = dict()
+
+        def arguments():
+            version = self.lexicons.version()
+            for note in notes:
+                sections = note[2] if len(note) > 2 else None
+                key = self.key(note[0], context_size, sections, version)
+                if key in copies:
+                    # resolved when the first copy comes back, which is
+                    # always before this one in the output
+                    copy = Future()
+                    copies[key].append((copy, note[0], note[1]))
+                    keys.append((key, False))
+                    yield copy
+                    continue
+                clues = self.get(key, note[0], note[1])
+                if clues is None:
+                    copies[key] = []
+                    keys.append((key, True))
+                    yield (note[0], note[1], context_size, sections)
+                else:
+                    cached = Future()
+                    cached.set_result((clues, None))
+                    keys.append((key, False))
+                    yield cached
+
+        for result in pool_imap(mine_timed, arguments(), workers, max_pending,
+                                init_worker, return_exceptions=return_exceptions):
+            (key, mined) = keys.popleft()
+            if isinstance(result, Exception):
+                if mined:
+                    for (copy, _, _) in copies.pop(key):
+                        copy.set_exception(result)
+                yield result
+                continue
+            (clues, seconds) = result
+            if mined:
+                entry = self.put(key, clues, seconds)
+                for (copy, text, init_data) in copies.pop(key):
+                    with self.lock:
+                        self.hits += 1
+                        self.saved += seconds
+                    copy.set_result((self.restore(entry, text, init_data), None))
+            yield clues
+
+    def stats(self):
+        """hits, misses, hit rate and seconds of mining saved so far"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'saved_seconds': self.saved,
+                    'size': len(self.memory)}
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection[1].close()
+                self.connection = None
+
+
+def mine_timed(text, init_data=None, context_size=5, sections=None):
+    """(clues, seconds) of mining one note, loading the lexicons is not
+    part of it"""
+    registry = lexicon_registry()
+    if not registry.loaded():
+        registry.preload()
+    start = time.perf_counter()
+    clues = MedNotesMiner(text, init_data, sections=sections).extract_all(context_size)
+    return (clues, time.perf_counter() - start)
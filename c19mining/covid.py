@@ -11,152 +11,170 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), ".", ".."))
 
 from c19mining.textprocessing import Tokenizer
-from c19mining.utils import (HOME, explore_dir,
-                             sampling_regex, decease_regex,
-                             covid19, covid_namedict,
-                             context_morbidities_regex, morbidities_namedict,
-                             context_symptoms_regex, symptoms_namedict,
-                             context_deseases_regex, deseases_namedict,
-                             context_drugs_regex, drugs_namedict)
-import re
-import pandas as pd
-import simplejson as json
+from c19mining.gazetteer import TokenIndex
+from c19mining.utils import (HOME, CLUE_CATEGORIES, LISTED_CLUES, WIKIDATA_URL,
+                             explore_dir, lexicon_registry, pool_imap)
+from bisect import bisect_right
 
 
 class MedNotesMiner(object):
     """Medical notes data miner for Covid-19 insights"""
-    def __init__(self, text_utf8, init_data=None):
+    def __init__(self, text_utf8, init_data=None, lexicons=None, sections=None):
         super(MedNotesMiner, self).__init__()
-        self.wikidata_url = 'https://www.wikidata.org/wiki/'
+        self.wikidata_url = WIKIDATA_URL
         self.text = text_utf8
+        # (title, start offset) of the sections the text is made of
+        self.sections = sections
         self.clues = init_data if init_data else dict()
         self.clues['texto'] = self.text
         self.working_text = self.preproc_tex()
-        self.sampling_re = sampling_regex()
-        self.decease_re = decease_regex()
-        self.covid19_db = covid19()
-        self.covid_dict = covid_namedict()
-        self.symptoms_re = context_symptoms_regex()
-        self.symptoms_dict = symptoms_namedict()
-        self.drugs_re = context_drugs_regex()
-        self.drugs_dict = drugs_namedict()
-        self.morbidities_re = context_morbidities_regex()
-        self.morbidities_dict = morbidities_namedict()
+        # token offsets shared by every scan of this note
+        self.index = TokenIndex(self.working_text)
+        # lexicons are loaded once per process and shared by all miners
+        self.lexicons = lexicons if lexicons else lexicon_registry()
+        self.clues_gz = self.lexicons.get('clues_gz')
+        # code ids of the clues gazetteer
+        self.codes = self.clues_gz.codes
+        self.mentions = []
+        self.negations = self.lexicons.get('negations').scope(self.index)
 
     def preproc_tex(self):
-        tokenizer = Tokenizer()
-        lower_text = self.text.lower()
-        tokenized = tokenizer.split_tokens(lower_text)
-        return tokenized
-
-    def check_covid19(self, lower_case=True):
-        """match covid-19 mentions"""
-        patch_pattern = r'(hospital receptor de covid|receptora de covid|hospital de concentracion para covid)'
-        self.clues['COVID-19'] = {}
-
-        # seek for covid matches
-        for (covid_key, covid_name) in self.covid19_db:
-            #TODO: method argumen contex_size
-            regex = r'((\w+\W+){0,5}\b'+covid_name+r'\b(\W+\w+){0,5})'
-            for covid_mention in re.finditer(regex, self.working_text):
-                context_mention = '...'+(covid_mention.groups()[0]).replace('\n', ' ')+'...'
-                covid_info = {'descripción': covid_name,
-                              'mención': context_mention,
-                              'wikidata': '{}{}'.format(self.wikidata_url, covid_key)}
-
-                if re.search(patch_pattern, context_mention, flags=0):
-                    #print('Negación de "{}"" detectada:\n\n{}\n'.format(covid_name, context_mention))
-                    continue
-
-                if not covid_key in self.clues['COVID-19']:
-                    self.clues['COVID-19'][covid_key] = [covid_info]
-                else:
-                    self.clues['COVID-19'][covid_key].append(covid_info)
-
-    def check_symptoms(self, lower_case=True):
-        """match covid-19 symptoms"""
-        self.clues['síntomas'] = {}
-
-        # seek for symptoms matches
-        for symptom_mention in self.symptoms_re.finditer(self.working_text):
-            context_mention = '...'+(symptom_mention.groups()[0]).replace('\n', ' ')+'...'
-            symptom_name = symptom_mention.groups()[2]
-            symptom_key = self.symptoms_dict[symptom_name]
-            symptom_info = {'descripción': symptom_mention.groups()[2],
-                            'mención': context_mention,
-                            'wikidata': '{}{}'.format(self.wikidata_url, symptom_key)}
-
-            patch_pattern = r'(sin '+symptom_name+r'|niega '+symptom_name+r'|sin compañía de '+symptom_name+r'|ni '+symptom_name+r')'
-            if re.search(patch_pattern, context_mention, flags=0):
-                #print('Negación de "{}"" detectada:\n\n{}\n'.format(symptom_name, context_mention))
+        """lowercase the note keeping its offsets, so mentions point back
+        into the original text"""
+        text = Tokenizer().read_text(self.text)
+        lower_text = text.lower()
+        if len(lower_text) != len(text):
+            # a few characters grow when lowercased, e.g. 'İ'
+            lower_text = ''.join([c.lower()[0] for c in text])
+        return lower_text
+
+    @staticmethod
+    def mine_batch(notes, workers=None, max_pending=None, context_size=5,
+                   return_exceptions=False, cache=None):
+        """Mine (text, init_data) pairs, or (text, init_data, sections)
+        triples, in a pool of worker processes.
+
+        Yields the clues of each note in input order. At most max_pending
+        notes (four per worker by default) are in flight at any time, so
+        notes can be a lazy iterable of any length. workers=1 mines in the
+        calling process. With return_exceptions a note that fails yields
+        its exception in place of its clues. With a MiningCache only the
+        notes it doesn't know are mined.
+        """
+        if cache is not None:
+            return cache.mine_batch(notes, workers, max_pending, context_size,
+                                    return_exceptions)
+        arguments = ((note[0], note[1], context_size) + tuple(note[2:]) for note in notes)
+        return pool_imap(mine_note, arguments, workers, max_pending, init_worker,
+                         return_exceptions=return_exceptions)
+
+    def extract_all(self, context_size=5):
+        """match covid-19, symptoms, sampling, decease, comorbidities and
+        drugs mentions with a single scan of the text"""
+        self.find_mentions()
+        self.clues.update(self.render(context_size))
+        return self.clues
+
+    def find_mentions(self, categories=CLUE_CATEGORIES):
+        """Mention of every clue of categories in the note, negated ones
+        left out, with a single scan of the text"""
+        wanted = set(CLUE_CATEGORIES.index(category) for category in categories)
+        self.mentions = []
+        for (category, code, name, first, last) in self.clues_gz.search(self.index.tokens):
+            if category not in wanted:
                 continue
-
-            if not symptom_key in self.clues['síntomas']:
-                self.clues['síntomas'][symptom_key] = [symptom_info]
+            category_name = CLUE_CATEGORIES[category]
+            if category_name not in LISTED_CLUES and self.negations.negated(category_name, first, last):
+                continue
+            self.mentions.append(Mention(category, code, name, first, last))
+        return self.mentions
+
+    def render(self, context_size=5, categories=CLUE_CATEGORIES):
+        """the clues of categories from the mentions found, codes, urls,
+        contexts and sections are only turned into strings here"""
+        clues = {category: [] if category in LISTED_CLUES else {} for category in categories}
+        starts = [start for (_, start) in self.sections] if self.sections else None
+        for mention in self.mentions:
+            category = CLUE_CATEGORIES[mention.category]
+            if category not in clues:
+                continue
+            (start, end) = self.index.span(mention.first, mention.last)
+            context = '...'+self.index.context(mention.first, mention.last, context_size).replace('\n', ' ')+'...'
+            if category in LISTED_CLUES:
+                info = {'mención': context, 'posición': [start, end]}
+                clues[category].append(info)
             else:
-                self.clues['síntomas'][symptom_key].append(symptom_info)
+                code = self.codes[mention.code]
+                info = {'descripción': mention.name, 'mención': context, 'posición': [start, end]}
+                if category == 'medicamentos':
+                    info['SAICA'] = '{}'.format(code)
+                else:
+                    info['wikidata'] = '{}{}'.format(self.wikidata_url, code)
+                clues[category].setdefault(code, []).append(info)
+            if starts is not None:
+                # title of the section the mention comes from
+                info['sección'] = self.sections[max(bisect_right(starts, start) - 1, 0)][0]
+        return clues
+
+    def check(self, category, context_size=5):
+        """match the mentions of a single category"""
+        self.find_mentions([category])
+        self.clues.update(self.render(context_size, [category]))
+
+    def check_covid19(self, context_size=5):
+        """match covid-19 mentions"""
+        self.check('COVID-19', context_size)
 
-    def check_drugs(self, lower_case=True):
+    def check_symptoms(self, context_size=5):
         """match covid-19 symptoms"""
-        self.clues['medicamentos'] = {}
-
-        # seek for matches
-        for drugs_mention in self.drugs_re.finditer(self.working_text):
-            context_mention = '...'+(drugs_mention.groups()[0]).replace('\n', ' ')+'...'
-            drug_name = drugs_mention.groups()[2]
-            drug_key = self.drugs_dict[drug_name]
-            drug_info = {'descripción': drugs_mention.groups()[2],
-                            'mención': context_mention,
-                            'SAICA': '{}'.format(drug_key)}
-
-            if not drug_key in self.clues['medicamentos']:
-                self.clues['medicamentos'][drug_key] = [drug_info]
-            else:
-                self.clues['medicamentos'][drug_key].append(drug_info)
+        self.check('síntomas', context_size)
 
-    def check_comorbidities(self, lower_case=True):
-        """match covid-19 comorbidities"""
-        self.clues['comorbilidades'] = {}
-
-        # seek for comorbidities matches
-        for morbid_mention in self.morbidities_re.finditer(self.working_text):
-            context_mention = '...'+(morbid_mention.groups()[0]).replace('\n', ' ')+'...'
-            morbid_name = morbid_mention.groups()[2]
-            comorbidity_key = self.morbidities_dict[morbid_name]
-            comorbidity_info = {'descripción': morbid_mention.groups()[2],
-                                'mención': context_mention,
-                                'wikidata': '{}{}'.format(self.wikidata_url, comorbidity_key)}
-
-            patch_pattern = r'(sin '+morbid_name+r'|niega '+morbid_name+r'|sin compañía de '+morbid_name+r'|ni '+morbid_name+r'|'+morbid_name+'nega'+r')'
-            if re.search(patch_pattern, context_mention, flags=0):
-                #print('Negación de "{}"" detectada:\n\n{}\n'.format(morbid_name, context_mention))
-                continue
+    def check_drugs(self, context_size=5):
+        """match drugs mentions"""
+        self.check('medicamentos', context_size)
 
-            if not comorbidity_key in self.clues['comorbilidades']:
-                self.clues['comorbilidades'][comorbidity_key] = [comorbidity_info]
-            else:
-                self.clues['comorbilidades'][comorbidity_key].append(comorbidity_info)
+    def check_comorbidities(self, context_size=5):
+        """match covid-19 comorbidities"""
+        self.check('comorbilidades', context_size)
 
-    def check_sampling(self):
+    def check_sampling(self, context_size=5):
         """match covid-19 sampling mentions"""
-        self.clues['muestreos'] = []
+        self.check('muestreos', context_size)
 
-        # seek for sampling matches
-        for sampling_mention in self.sampling_re.finditer(self.working_text):
-            context_mention = '...'+(sampling_mention.groups()[0]).replace('\n', ' ')+'...'
-            self.clues['muestreos'].append({'mención': context_mention})
-
-    def check_decease(self):
+    def check_decease(self, context_size=5):
         """match decease mentions"""
-        self.clues['defunciones'] = []
+        self.check('defunciones', context_size)
+
+
+class Mention(object):
+    """A clue found in a note, kept compact until it is rendered.
 
-        # seek for decease matches
-        for decease_mention in self.decease_re.finditer(self.working_text):
-            context_mention = '...'+(decease_mention.groups()[0]).replace('\n', ' ')+'...'
-            self.clues['defunciones'].append({'mención': context_mention})
+    category is its index in CLUE_CATEGORIES, code the id of its code in the
+    CodeTable of the clues gazetteer, name the lexicon name matched, shared
+    with the lexicon, and first to last (exclusive) its tokens.
+    """
+    __slots__ = ('category', 'code', 'name', 'first', 'last')
+
+    def __init__(self, category, code, name, first, last):
+        self.category = category
+        self.code = code
+        self.name = name
+        self.first = first
+        self.last = last
+
+
+def init_worker():
+    """load every lexicon once when a worker process starts"""
+    lexicon_registry().preload()
+
+def mine_note(text, init_data=None, context_size=5, sections=None):
+    """extract all clues from one note"""
+    return MedNotesMiner(text, init_data, sections=sections).extract_all(context_size)
 
 
 if __name__ == '__main__':
+    import simplejson as json
+
     texto_urgencia ='''
     Paciente con presencia d epolipnea, orientado en tiempo, lugar y espacio. Funciones mentales superiores conservadas. Tegumentos
     deshidratados. Craneo: Sin palpar endostosis ni exostosis y sin detectar crepitaciones. Pupilas Isocéricas y normorrefléxicas, escleréticas sin
@@ -171,11 +189,7 @@ if __name__ == '__main__':
     '''
     # Information Extraction
     covid_seeker = MedNotesMiner(texto_urgencia)
-    covid_seeker.check_covid19()
-    covid_seeker.check_symptoms()
-    covid_seeker.check_sampling()
-    covid_seeker.check_decease()
-    covid_seeker.check_comorbidities()
+    covid_seeker.extract_all()
 
     covid_insights =  json.dumps(covid_seeker.clues, ensure_ascii=False, encoding='utf-8', indent=2)
     print(covid_insights)
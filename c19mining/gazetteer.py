@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Token level gazetteer. Lexicon names are stored in a trie of tokens so all
+# the longest non-overlapping mentions are found in one left to right pass,
+# instead of trying every alternative of a huge regex at each position.
+
+import re
+from collections import namedtuple
+
+# Spanish clinical tokens, the same way for lexicons and notes: numbers
+# keeping inner dots, commas or slashes (110/60, 8.7, 0,5), words keeping
+# inner hyphens or apostrophes (covid-19), ellipsis and any other single
+# symbol, so 'fiebre,tos' is still three tokens
+TOKEN_RE = re.compile(r"\d+(?:[.,/]\d+)+|\w+(?:[-']\w+)*|\.\.+|[^\w\s]")
+
+# category, code and name come from the lexicon, start/end are offsets in the
+# searched text, first/last are token positions (last exclusive) and context
+# is the text surrounding the mention
+GazetteerMatch = namedtuple('GazetteerMatch',
+    ['category', 'code', 'name', 'start', 'end', 'first', 'last', 'context'])
+
+
+class TokenIndex(object):
+    """Tokens of a text with their offsets, built once per text.
+
+    Context windows are sliced from the offsets, so any context size costs
+    the same.
+    """
+    def __init__(self, text):
+        super(TokenIndex, self).__init__()
+        self.text = text
+        self.tokens = []
+        self.starts = []
+        self.ends = []
+        for m in TOKEN_RE.finditer(text):
+            self.tokens.append(m.group())
+            self.starts.append(m.start())
+            self.ends.append(m.end())
+
+    def span(self, first, last):
+        """character offsets of tokens first to last (exclusive)"""
+        return (self.starts[first], self.ends[last - 1])
+
+    def context(self, first, last, context_size):
+        """text of tokens first to last plus context_size tokens each side"""
+        left = self.starts[max(0, first - context_size)]
+        right = self.ends[min(len(self.tokens), last + context_size) - 1]
+        return self.text[left:right]
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+class CodeTable(object):
+    """Codes of a lexicon as small ints, in the order they were added.
+
+    The same code always gets the same id, so code comparisons are integer
+    comparisons and the code strings are kept once.
+    """
+    def __init__(self, codes=None):
+        super(CodeTable, self).__init__()
+        self.codes = []
+        self.ids = dict()
+        for code in codes or []:
+            self.intern(code)
+
+    def intern(self, code):
+        """the id of code, a new one the first time it is seen"""
+        code_id = self.ids.get(code)
+        if code_id is None:
+            code_id = self.ids[code] = len(self.codes)
+            self.codes.append(code)
+        return code_id
+
+    def __getitem__(self, code_id):
+        return self.codes[code_id]
+
+    def __contains__(self, code):
+        return code in self.ids
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class Gazetteer(object):
+    """Trie of lexicon names for longest match lookup over tokens.
+
+    With a CodeTable under codes, entries hold code ids instead of codes.
+    """
+    def __init__(self, entries=None, category=None, codes=None):
+        super(Gazetteer, self).__init__()
+        self.root = dict()
+        self.size = 0
+        self.codes = codes
+        if entries:
+            self.update(entries, category)
+
+    def add(self, name, code, category=None):
+        """add a name, a later entry with the same name replaces the code"""
+        node = self.root
+        for token in TOKEN_RE.findall(name):
+            node = node.setdefault(token, dict())
+        if node is self.root:
+            return
+        # terminal nodes keep their entries under the None key
+        entries = node.setdefault(None, dict())
+        if category not in entries:
+            self.size += 1
+        entries[category] = (code, name)
+
+    def update(self, entries, category=None):
+        """add (code, name) pairs as loaded by load_csv"""
+        for (code, name) in entries:
+            self.add(name, code, category)
+
+    def search(self, tokens):
+        """yield (category, code, name, first, last) token positions of the
+        longest non-overlapping matches, last is exclusive.
+
+        Matches of different categories may overlap each other.
+        """
+        root = self.root
+        size = len(tokens)
+        free = dict()
+        for first in range(size):
+            node = root.get(tokens[first])
+            if node is None:
+                continue
+            longest = dict()
+            last = first + 1
+            while True:
+                if None in node:
+                    for (category, entry) in node[None].items():
+                        longest[category] = (entry, last)
+                if last == size:
+                    break
+                node = node.get(tokens[last])
+                if node is None:
+                    break
+                last += 1
+            for (category, ((code, name), end)) in longest.items():
+                if first >= free.get(category, 0):
+                    free[category] = end
+                    yield (category, code, name, first, end)
+
+    def finditer(self, text, context_size=5):
+        """yield a GazetteerMatch for each mention found in text, which may
+        be a string or an already built TokenIndex"""
+        index = text if isinstance(text, TokenIndex) else TokenIndex(text)
+        for (category, code, name, first, last) in self.search(index.tokens):
+            (start, end) = index.span(first, last)
+            yield GazetteerMatch(category, code, name, start, end, first, last,
+                                 index.context(first, last, context_size))
+
+    def sub(self, template, text):
+        """replace every mention with template.format(mention)"""
+        pieces = []
+        position = 0
+        for match in self.finditer(text, context_size=0):
+            pieces.append(text[position:match.start])
+            pieces.append(template.format(text[match.start:match.end]))
+            position = match.end
+        pieces.append(text[position:])
+        return ''.join(pieces)
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# NegEx style negation. Triggers come from resources/negaciones.csv, e.g.
+#
+#   trigger	tipo	alcance	categorias
+#   sin	pre	0	síntomas,comorbilidades
+#
+# tipo is where the trigger stands: 'pre' before the concept, 'post' after it
+# or 'excl' anywhere around it (an exclusion phrase). alcance is how many
+# tokens may lie between trigger and concept, and categorias are the clues
+# categories the rule applies to. A scope never goes past the end of a
+# sentence or an exclusion phrase, e.g. in 'tabaquismo, alcoholismo;
+# interrogados y negados' both are negated, in 'tabaquismo. tos negada'
+# tabaquismo is not.
+
+from c19mining.gazetteer import (Gazetteer, TokenIndex)
+
+# tokens ending a sentence
+SENTENCE_ENDS = frozenset(['.', '!', '?'])
+
+
+class NegationDetector(object):
+    """Compiled negation and exclusion triggers"""
+    def __init__(self, rules):
+        super(NegationDetector, self).__init__()
+        # (trigger, tipo) -> {category: scope}
+        scopes = dict()
+        for (trigger, kind, scope, categories) in rules:
+            for category in categories:
+                scopes.setdefault((trigger, kind), dict())[category] = scope
+        self.triggers = Gazetteer()
+        for ((trigger, kind), by_category) in scopes.items():
+            self.triggers.add(trigger, by_category, kind)
+        self.max_scope = max([scope for (_, _, scope, _) in rules] + [0])
+
+    def scope(self, text):
+        """find the triggers of a text (or TokenIndex) once"""
+        index = text if isinstance(text, TokenIndex) else TokenIndex(text)
+        return NegationScope(self, index)
+
+
+class NegationScope(object):
+    """Negation triggers found in one note, queried by token positions"""
+    def __init__(self, detector, index):
+        super(NegationScope, self).__init__()
+        self.max_scope = detector.max_scope
+        self.pre = dict()
+        self.post = dict()
+        self.excluded = dict()
+        stops = bytearray(len(index))
+        for (position, token) in enumerate(index.tokens):
+            if token in SENTENCE_ENDS:
+                stops[position] = 1
+        for (kind, by_category, _, first, last) in detector.triggers.search(index.tokens):
+            if kind == 'pre':
+                self.pre[last - 1] = by_category
+            elif kind == 'post':
+                self.post[first] = by_category
+            else:
+                stops[first:last] = b'\x01' * (last - first)
+                for (category, scope) in by_category.items():
+                    self.excluded.setdefault(category, set()).update(
+                        range(first - scope, last + scope))
+        # stops before each position, so a range has one if their counts differ
+        self.stops = [0]
+        for stop in stops:
+            self.stops.append(self.stops[-1] + stop)
+
+    def stopped(self, first, last):
+        """True if a stop lies in tokens first to last (exclusive)"""
+        return self.stops[last] != self.stops[first]
+
+    def negated(self, category, first, last):
+        """True if tokens first to last (exclusive) of category are negated"""
+        excluded = self.excluded.get(category)
+        if excluded and any(position in excluded for position in range(first, last)):
+            return True
+        for gap in range(self.max_scope + 1):
+            before = self.pre.get(first - 1 - gap)
+            if before and gap <= before.get(category, -1) and not self.stopped(first - gap, first):
+                return True
+            after = self.post.get(last + gap)
+            if after and gap <= after.get(category, -1) and not self.stopped(last, last + gap):
+                return True
+        return False
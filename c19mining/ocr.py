@@ -9,12 +9,6 @@
 import os
 from os.path import (join, splitext, exists)
 from c19mining.utils import (mkdir, explore_dir)
-import pdf2image
-try:
-    from PIL import Image
-except ImportError:
-    import Image
-import pytesseract
 
 class TesseOCR(object):
     """An Optical Character Recognition class based on tesseract"""
@@ -24,6 +18,8 @@ class TesseOCR(object):
 
     def get_text_from_pdf(self, pdf_path):
         """convert a pdf file into text"""
+        import pdf2image
+        import pytesseract
         text = ''
         images = pdf2image.convert_from_path(pdf_path)
         for pg, img in enumerate(images):
@@ -32,6 +28,11 @@ class TesseOCR(object):
 
     def get_text_from_jpg(self, image_path):
         """convert a jpg image into text"""
+        try:
+            from PIL import Image
+        except ImportError:
+            import Image
+        import pytesseract
         try:
             img = Image.open(image_path)
         except Exception as e:
@@ -8,126 +8,388 @@
 
 import sys
 import os
-from os.path import (join, dirname, exists)
+from os.path import (join, dirname, exists, isdir)
 sys.path.append(join(dirname(__file__), ".", ".."))
 
 from c19mining.utils import (HOME, EXCELS_DIR, explore_dir,
                              canonical_symptoms_name, canonical_symptoms_order,
                              canonical_comorbs_name, canonical_comorbs_order,
                              canonical_covid_name, get_time)
+from c19mining.sinks import (extraction_files, read_extraction_file)
+from c19mining.store import (ExtractionStore, is_store, admission_day)
 import string
-import pandas as pd
 import simplejson as json
-from collections import Counter
-import datetime
+
+# columns of the main and the evidence sheets
+REPORT_COLUMNS = ['NHC', 'Nombre (s)', 'Apellido paterno', 'Apellido Materno',
+                  'Fecha de Ingreso', 'Servicio', 'Síntomas', 'Diagnóstico COVID-19',
+                  'Comorbilidad']
+EVIDENCE_COLUMNS = ['Menciones Síntomas', 'Menciones Diagnóstico', 'Menciones Comorbilidad',
+                    'Menciones Pruebas', 'Menciones Defunción']
+# bump when the layout of the saved report state changes
+REPORT_STATE_VERSION = 3
 
 
 class ReportGenerator(object):
-    """creates a report from all medical notes in a directory"""
-    def __init__(self, mednotes_dir, excels_dir=EXCELS_DIR, only_covid=False):
+    """Creates a report from all medical notes in a directory, stored as
+    JSON files or JSON lines shards by any of the sinks, or in an
+    ExtractionStore given by the path of its .sqlite file.
+
+    With a state_path the notes read are kept there, along with the size
+    and mtime of each extraction file, and the next report over the same
+    directory only reads the files added or changed since. The state is
+    built again from scratch when it comes from another version or other
+    canonical lists, or when an extraction file it read is gone. From a
+    store, only the notes stored after the last one read are read.
+
+    desde and hasta (dates, both included) keep only the notes admitted in
+    that window. From a store just the notes of the window are read, by
+    its index of admission days, without any state.
+    """
+    def __init__(self, mednotes_dir, excels_dir=EXCELS_DIR, only_covid=False,
+                 state_path=None, desde=None, hasta=None):
         super(ReportGenerator, self).__init__()
         self.mednotes_dir = mednotes_dir
         self.excels_dir = excels_dir
         self.only_covid = only_covid
+        self.state_path = state_path
+        self.desde = desde
+        self.hasta = hasta
         self.symptoms = canonical_symptoms_name()
         self.symptcols_order = canonical_symptoms_order()
         self.comorbs = canonical_comorbs_name()
         self.comorbscols_order = canonical_comorbs_order()
+        (self.symptom_names, self.symptom_columns) = self.code_columns(self.symptoms, self.symptcols_order)
+        (self.comorb_names, self.comorb_columns) = self.code_columns(self.comorbs, self.comorbscols_order)
         self.data_frames()
 
-    def register_as_dict(self, medical_register):
-        """depending on the object will open a file or not"""
-        if isinstance(medical_register, dict):
-            json_register = medical_register
-        elif os.path.exists(medical_register):
-            with open(medical_register) as fp:
-                json_register = json.load(fp, encoding='utf-8')
-        else:
-            print(medical_register, 'KO')
-            json_register = None
-        return json_register
-
     def data_frames(self, only_covid=False):
-        main_report = list()
-        evidence = list()
-        symptomsl = list()
-        comorbis = list()
-        for (MedNote_path, MedNote_bname) in explore_dir(self.mednotes_dir, yield_extension='JSON'):
-            evidence_info = dict()
-            sympt_info = dict()
-            comorbs_info = dict()
-
-            medical_register = self.register_as_dict(MedNote_path)
-            # If report must include only COVID detected
-            if (self.only_covid and len(medical_register['COVID-19']) == 0):
+        """Build the report data frames column by column.
+
+        Symptoms and comorbidities are boolean matrices (notes x canonical
+        names) where only the cells of the codes found are set, codes
+        sharing a canonical name share their column.
+        """
+        import numpy as np
+        import pandas as pd
+        if is_store(self.mednotes_dir) and self.windowed():
+            self.reset_state()
+            with ExtractionStore(self.mednotes_dir) as store:
+                for (_, medical_register) in store.read(desde=self.desde, hasta=self.hasta):
+                    self.add_register(medical_register)
+        else:
+            if not self.load_state():
+                self.reset_state()
+            if is_store(self.mednotes_dir):
+                changed = self.read_store()
+            else:
+                changed = self.read_files()
+            if changed and self.state_path:
+                self.save_state()
+
+        # create dfs, If report must include only COVID detected and
+        # admitted in the window
+        size = len(self.rows)
+        keep = np.ones(size, dtype=bool)
+        if self.only_covid:
+            keep &= self.covid[:size]
+        if self.desde is not None:
+            keep &= self.days[:size] >= np.datetime64(self.desde, 'D')
+        if self.hasta is not None:
+            keep &= self.days[:size] <= np.datetime64(self.hasta, 'D')
+        self.keep = keep
+        self.df_report = pd.DataFrame(self.main_report)[keep].reset_index(drop=True)
+        self.df_evidence = pd.DataFrame(self.evidence)[keep].reset_index(drop=True)
+        self.df_symptoms = pd.DataFrame(self.symptom_matrix[:size][keep], columns=self.symptom_names)
+        self.df_comorbs = pd.DataFrame(self.comorb_matrix[:size][keep], columns=self.comorb_names)
+
+    def read_files(self):
+        """add the notes of the extraction files added or changed since the
+        state, True if any was read"""
+        # extraction files by their path relative to mednotes_dir
+        files = {(os.path.relpath(file_path, self.mednotes_dir)
+                  if isdir(self.mednotes_dir) else ''): file_path
+                 for file_path in extraction_files(self.mednotes_dir)}
+        if any(path not in files for path in self.manifest):
+            # notes of a removed file can't be told apart, read everything
+            self.reset_state()
+        changed = False
+        for (path, file_path) in files.items():
+            stat = os.stat(file_path)
+            stamp = [stat.st_size, stat.st_mtime_ns]
+            if self.manifest.get(path) == stamp:
                 continue
-
-            main_info = {'NHC': medical_register['NHC'],
-            'Nombre (s)': medical_register['Nombre'],
-                'Apellido paterno': medical_register['Apellido Paterno'],
-                'Apellido Materno': medical_register['Apellido Materno'],
-                'Fecha de Ingreso':medical_register['Fecha de Ingreso'],
-                'Servicio': 'Urgencias'}
-
-            symptoms, symptoms_evidence = self.symptoms_to_val(medical_register)
-            main_info.update({'Síntomas': symptoms})
-            evidence_info.update({'Menciones Síntomas': symptoms_evidence})
-
-            covid_diagnosis, covid_diagnosis_evidence = self.covid_diagnosis_to_val(medical_register)
-            main_info.update({'Diagnóstico COVID-19': covid_diagnosis})
-            evidence_info.update({'Menciones Diagnóstico': covid_diagnosis_evidence})
-
-            comorbs, comorbs_evidence = self.comorbidities_to_val(medical_register)
-            main_info.update({'Comorbilidad': comorbs})
-            evidence_info.update({'Menciones Comorbilidad': comorbs_evidence})
-
-            samplings_evidence = self.sampling_to_val(medical_register)
-            evidence_info.update({'Menciones Pruebas': samplings_evidence})
-
-            decease_evidence = self.decease_to_val(medical_register)
-            evidence_info.update({'Menciones Defunción': decease_evidence})
-
-            # symptoms boolean matrix
-            sympt_info.update({self.symptoms[code]: (True if code in medical_register['síntomas'] else False)
-             for code in self.symptcols_order})
-            # comorbs boolean matrix
-            comorbs_info.update({self.comorbs[code]: (True if code in medical_register['comorbilidades'] else False)
-             for code in self.comorbscols_order})
-
-            # append register
-            main_report.append(main_info)
-            evidence.append(evidence_info)
-            symptomsl.append(sympt_info)
-            comorbis.append(comorbs_info)
-
-        # create dfs
-        self.df_report = pd.DataFrame(data=main_report)
-        self.df_symptoms = pd.DataFrame(data=symptomsl)
-        self.df_comorbs = pd.DataFrame(data=comorbis)
-        self.df_evidence = pd.DataFrame(data=evidence)
-
-    def to_excel(self, out_directory=None):
-        """Read a set of JSON by MedNotesMiner to form a excel"""
-
-        # path to generated excel
+            for medical_register in read_extraction_file(file_path):
+                self.add_register(medical_register)
+            self.manifest[path] = stamp
+            changed = True
+        return changed
+
+    def read_store(self):
+        """add the notes stored in the ExtractionStore after the last one
+        read, True if any was read"""
+        with ExtractionStore(self.mednotes_dir) as store:
+            if self.manifest.get('notas', 0) > store.last_id():
+                # not the store the state was built from
+                self.reset_state()
+            last_id = self.manifest.get('notas', 0)
+            for (last_id, medical_register) in store.read(after_id=last_id):
+                self.add_register(medical_register)
+        changed = last_id != self.manifest.get('notas', 0)
+        self.manifest['notas'] = last_id
+        return changed
+
+    def windowed(self):
+        return self.desde is not None or self.hasta is not None
+
+    def reset_state(self, capacity=1024):
+        import numpy as np
+        # (NHC, Fecha de Ingreso) of every note and its row
+        self.rows = dict()
+        self.main_report = {column: [] for column in REPORT_COLUMNS}
+        self.evidence = {column: [] for column in EVIDENCE_COLUMNS}
+        self.symptom_matrix = np.zeros((capacity, len(self.symptom_names)), dtype=bool)
+        self.comorb_matrix = np.zeros((capacity, len(self.comorb_names)), dtype=bool)
+        self.covid = np.zeros(capacity, dtype=bool)
+        # admission day of each note, NaT if unknown
+        self.days = np.zeros(capacity, dtype='datetime64[D]')
+        # running count of notes per canonical name, of all the notes and
+        # of the notes with COVID-19
+        self.symptom_totals = np.zeros((2, len(self.symptom_names)), dtype=np.int64)
+        self.comorb_totals = np.zeros((2, len(self.comorb_names)), dtype=np.int64)
+        # [size, mtime] of each extraction file read, by relative path, or
+        # under 'notas' the id of the last note read from a store
+        self.manifest = dict()
+
+    def add_register(self, medical_register):
+        """add the row of a note, a record mined again, by a resumed or a
+        later extraction, replaces the one read before"""
+        key = (medical_register['NHC'], medical_register['Fecha de Ingreso'])
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.rows)
+            self.rows[key] = row
+            if row == len(self.covid):
+                capacity = 2 * len(self.covid)
+                self.symptom_matrix = self.grow(self.symptom_matrix, capacity)
+                self.comorb_matrix = self.grow(self.comorb_matrix, capacity)
+                self.covid = self.grow(self.covid, capacity)
+                self.days = self.grow(self.days, capacity)
+        else:
+            self.count_row(row, -1)
+        self.covid[row] = len(medical_register['COVID-19']) > 0
+        self.days[row] = admission_day(medical_register['Fecha de Ingreso']) or 'NaT'
+
+        symptoms, symptoms_evidence = self.symptoms_to_val(medical_register)
+        covid_diagnosis, covid_diagnosis_evidence = self.covid_diagnosis_to_val(medical_register)
+        comorbs, comorbs_evidence = self.comorbidities_to_val(medical_register)
+        self.set_row(self.main_report, row,
+                     [medical_register['NHC'],
+                      medical_register['Nombre'],
+                      medical_register['Apellido Paterno'],
+                      medical_register['Apellido Materno'],
+                      medical_register['Fecha de Ingreso'],
+                      'Urgencias',
+                      symptoms,
+                      covid_diagnosis,
+                      comorbs])
+        self.set_row(self.evidence, row,
+                     [symptoms_evidence,
+                      covid_diagnosis_evidence,
+                      comorbs_evidence,
+                      self.sampling_to_val(medical_register),
+                      self.decease_to_val(medical_register)])
+
+        # symptoms and comorbs boolean matrices
+        self.symptom_matrix[row] = False
+        self.symptom_matrix[row, [self.symptom_columns[code] for code in medical_register['síntomas']
+                                  if code in self.symptom_columns]] = True
+        self.comorb_matrix[row] = False
+        self.comorb_matrix[row, [self.comorb_columns[code] for code in medical_register['comorbilidades']
+                                 if code in self.comorb_columns]] = True
+        self.count_row(row)
+
+    def count_row(self, row, sign=1):
+        """add a row to the running counts, or take it away with sign=-1"""
+        for (totals, matrix) in ((self.symptom_totals, self.symptom_matrix),
+                                 (self.comorb_totals, self.comorb_matrix)):
+            totals[0] += sign * matrix[row]
+            if self.covid[row]:
+                totals[1] += sign * matrix[row]
+
+    def symptom_counts(self):
+        """notes per canonical symptom name, a pandas Series"""
+        return self.counts(self.symptom_totals, self.symptom_matrix, self.symptom_names)
+
+    def comorbidity_counts(self):
+        """notes per canonical comorbidity name, a pandas Series"""
+        return self.counts(self.comorb_totals, self.comorb_matrix, self.comorb_names)
+
+    def counts(self, totals, matrix, names):
+        import pandas as pd
+        if self.windowed():
+            # running counts take every note, count those of the window
+            values = matrix[:len(self.rows)][self.keep].sum(axis=0)
+        else:
+            values = totals[1 if self.only_covid else 0]
+        return pd.Series(values, index=names)
+
+    def state_signature(self):
+        """what a saved state must have been built with to be reused"""
+        return {'version': REPORT_STATE_VERSION,
+                'mednotes_dir': os.path.abspath(self.mednotes_dir),
+                'symptoms': self.symptom_names,
+                'comorbidities': self.comorb_names}
+
+    def load_state(self):
+        """resume from the saved state, False if there is none to use"""
+        import numpy as np
+        if not self.state_path or not exists(self.state_path):
+            return False
+        try:
+            with np.load(self.state_path, allow_pickle=False) as saved:
+                meta = json.loads(saved['meta'].tobytes().decode('utf-8'))
+                if meta['signature'] != self.state_signature():
+                    return False
+                size = len(meta['keys'])
+                capacity = max(1024, 2 * size)
+                self.symptom_matrix = self.grow(saved['symptoms'], capacity)
+                self.comorb_matrix = self.grow(saved['comorbidities'], capacity)
+                self.covid = self.grow(saved['covid'], capacity)
+                self.days = self.grow(saved['days'], capacity)
+                self.symptom_totals = saved['symptom_totals']
+                self.comorb_totals = saved['comorbidity_totals']
+        except (OSError, ValueError, KeyError):
+            return False
+        self.rows = {tuple(key): row for (row, key) in enumerate(meta['keys'])}
+        self.main_report = meta['report']
+        self.evidence = meta['evidence']
+        self.manifest = meta['manifest']
+        return True
+
+    def save_state(self):
+        import numpy as np
+        size = len(self.rows)
+        meta = {'signature': self.state_signature(),
+                'keys': list(self.rows),
+                'report': self.main_report,
+                'evidence': self.evidence,
+                'manifest': self.manifest}
+        directory = dirname(self.state_path)
+        if directory and not exists(directory):
+            os.makedirs(directory)
+        # write aside and rename, a report never sees half a state
+        partial = self.state_path+'.partial'
+        with open(partial, 'wb') as f:
+            # meta as the bytes of its JSON, strings would take four bytes per character
+            meta = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+            np.savez(f, meta=meta,
+                     symptoms=self.symptom_matrix[:size],
+                     comorbidities=self.comorb_matrix[:size],
+                     covid=self.covid[:size],
+                     days=self.days[:size],
+                     symptom_totals=self.symptom_totals,
+                     comorbidity_totals=self.comorb_totals)
+        os.replace(partial, self.state_path)
+
+    def code_columns(self, names, order):
+        """(column names, {code: column}) of canonical codes in order"""
+        columns = dict()
+        code_column = dict()
+        for code in order:
+            code_column[code] = columns.setdefault(names[code], len(columns))
+        return (list(columns), code_column)
+
+    def grow(self, matrix, capacity):
+        """matrix with capacity rows, the new ones unset"""
+        import numpy as np
+        grown = np.zeros((capacity,) + matrix.shape[1:], dtype=matrix.dtype)
+        grown[:len(matrix)] = matrix
+        return grown
+
+    def set_row(self, columns, row, values):
+        for (column, value) in zip(columns.values(), values):
+            if row == len(column):
+                column.append(value)
+            else:
+                column[row] = value
+
+    def period(self):
+        """first and last admission day of the report, e.g. 20200301-20200531,
+        the window when given, empty without dated notes"""
+        import numpy as np
+        days = self.days[:len(self.rows)][self.keep]
+        days = days[~np.isnat(days)]
+        first = np.datetime64(self.desde, 'D') if self.desde is not None else (days.min() if len(days) else None)
+        last = np.datetime64(self.hasta, 'D') if self.hasta is not None else (days.max() if len(days) else None)
+        if first is None or last is None:
+            return ''
+        (first, last) = (day.astype(object).strftime('%Y%m%d') for day in (first, last))
+        return first if first == last else first+'-'+last
+
+    def sheets(self):
+        """(file suffix, sheet name, data frame) of each part of the report,
+        sheet names end with the period, within the 31 characters of Excel"""
+        period = self.period()
+        return [(suffix, (name+' '+period).strip()[:31], df) for (suffix, name, df) in
+                [('concentrado', 'Concentrado', self.df_report),
+                 ('evidencia', 'Evidencia', self.df_evidence),
+                 ('sintomas', 'síntomas', self.df_symptoms),
+                 ('comorbilidad', 'Comorbilidad', self.df_comorbs)]]
+
+    def output_path(self, out_directory, extension, suffix=None):
         if not exists(self.excels_dir):
             os.makedirs(self.excels_dir)
         dt_string = get_time()
         out_directory = out_directory if out_directory else self.excels_dir
-        output = join(out_directory, 'informe_de_covid_'+dt_string+'.xlsx')
+        # reports of different windows don't overwrite each other
+        if self.windowed():
+            dt_string += '_'+self.period()
+        fname = 'informe_de_covid_'+dt_string+('_'+suffix if suffix else '')
+        return join(out_directory, fname+extension)
+
+    def to_excel(self, out_directory=None):
+        """Read a set of JSON by MedNotesMiner to form a excel.
+
+        Sheets are written row by row to a write only workbook, memory
+        doesn't grow with the number of notes.
+        """
+        # path to generated excel
+        output = self.output_path(out_directory, '.xlsx')
+        # column widths of some sheets
+        widths = {'concentrado': ('B', 'V', 30),
+                  'evidencia': ('B', 'F', 40)}
 
         # write excel file
-        try:
-            with pd.ExcelWriter(output) as writer:
-                self.df_report.to_excel(writer, sheet_name='Concentrado '+'marzo-mayo-2020')
-                self.df_evidence.to_excel(writer, sheet_name='Evidencia '+'marzo-mayo-2020')
-                self.df_symptoms.to_excel(writer, sheet_name='síntomas '+'marzo-mayo-2020')
-                self.df_comorbs.to_excel(writer, sheet_name='Comorbilidad'+'marzo-mayo-2020')
-                # set shit width
-                self.set_width(writer, 'Concentrado marzo-mayo-2020', 'B', 'V', 30)
-                self.set_width(writer, 'Evidencia marzo-mayo-2020', 'B', 'F', 40)
-        except Exception as e:
-            raise e
+        with ExcelStream(output) as writer:
+            for (suffix, sheet_name, df) in self.sheets():
+                writer.add_sheet(sheet_name)
+                # set sheet width, before any row is written
+                if suffix in widths:
+                    self.set_width(writer, sheet_name, *widths[suffix])
+                writer.write_frame(df, sheet_name)
+        return output
+
+    def to_csv(self, out_directory=None):
+        """one CSV file per sheet of the report, returns their paths"""
+        outputs = []
+        for (suffix, _, df) in self.sheets():
+            outputs.append(self.output_path(out_directory, '.csv', suffix))
+            df.to_csv(outputs[-1], index=False)
+        return outputs
+
+    def to_parquet(self, out_directory=None):
+        """one Parquet file per sheet of the report, returns their paths,
+        pandas needs pyarrow or fastparquet for it"""
+        from importlib.util import find_spec
+        if not (find_spec('pyarrow') or find_spec('fastparquet')):
+            raise ImportError('pyarrow or fastparquet is needed to write Parquet '
+                              'reports: pip install pyarrow')
+        outputs = []
+        for (suffix, _, df) in self.sheets():
+            outputs.append(self.output_path(out_directory, '.parquet', suffix))
+            df.to_parquet(outputs[-1], index=False)
+        return outputs
 
     def comorbidities_to_val(self, json_register):
         """return one single dataframe string value"""
@@ -196,45 +458,91 @@ class ReportGenerator(object):
             writer.sheets[sheet_name].column_dimensions[char].width = dwidth
 
 
+class ExcelStream(object):
+    """Write only Excel workbook, rows go to a temporary file as they come.
+
+    Like pandas.ExcelWriter it has the sheets by name, so set_width works
+    with both, but widths must be set before the rows of a sheet.
+    """
+    def __init__(self, path):
+        super(ExcelStream, self).__init__()
+        from openpyxl import Workbook
+        self.path = path
+        self.book = Workbook(write_only=True)
+        self.sheets = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_sheet(self, sheet_name):
+        self.sheets[sheet_name] = self.book.create_sheet(sheet_name)
+        return self.sheets[sheet_name]
+
+    def write_frame(self, df, sheet_name):
+        """the rows of a data frame with its index, as DataFrame.to_excel"""
+        sheet = self.sheets.get(sheet_name) or self.add_sheet(sheet_name)
+        sheet.append([None] + [str(column) for column in df.columns])
+        for row in df.itertuples(index=True, name=None):
+            # NaN cells are left empty
+            sheet.append([None if value != value else value for value in row])
+
+    def close(self):
+        self.book.save(self.path)
+
+
 class AmchartsGenerator(object):
     """Data frames into Amcharts data formats"""
     def __init__(self):
         super(AmchartsGenerator, self).__init__()
 
     def pictorial_stacked_chart(self, df, topn=5):
-        """https://www.amcharts.com/demos/pictorial-stacked-chart/"""
-        counts = df[df==True].count(axis=0)
-        dic_counts = Counter(counts.to_dict())
-        chart_data = [{"name": k, "value": v} for k,v in dic_counts.most_common(topn)]
+        """https://www.amcharts.com/demos/pictorial-stacked-chart/
+
+        df is a boolean data frame, e.g. report.df_symptoms, or the counts
+        per name, e.g. report.symptom_counts()
+        """
+        if topn <= 0:
+            return []
+        import numpy as np
+        counts = df.sum(axis=0) if df.ndim == 2 else df
+        values = counts.to_numpy()
+        if topn < len(values):
+            # the topn largest, plus any tie with the last of them
+            kth = np.partition(values, len(values) - topn)[len(values) - topn]
+            top = np.flatnonzero(values >= kth)
+        else:
+            top = np.arange(len(values))
+        # largest first, ties in column order
+        top = top[np.argsort(-values[top], kind='stable')][:topn]
+        chart_data = [{"name": counts.index[i], "value": int(values[i])} for i in top]
         return chart_data
 
-    def population_pyramid(self, admissions_dic, discharges_dic):
-        """https://www.amcharts.com/demos/population-pyramid/"""
-        chart_data = []
-
-        # sort by date to get start and end dates.
-        admissions_sorted_bydate = [date for (date,_) in sorted(admissions_dic.items(), key=lambda x: x[0])]
-        discharges_sorted_bydate = [date for (date,_) in sorted(discharges_dic.items(), key=lambda x: x[0])]
-        start_date = min(admissions_sorted_bydate[0], discharges_sorted_bydate[0])
-        end_date = max(admissions_sorted_bydate[-1], discharges_sorted_bydate[-1])
-        # day by day get admissions and discharges counts
-        d = start_date
-        while d < end_date:
-            try:
-                admissions = admissions_dic[d]
-            except:
-                admissions = 0
-                pass
-            try:
-                discharges = discharges_dic[d]
-            except:
-                discharges = 0
-                pass
-            chart_data.append({"fecha": d.strftime("%d/%m/%y"),
-                               "ingresos": admissions,
-                               "egresos": discharges})
-            d += datetime.timedelta(days=1)
-
+    def population_pyramid(self, admissions_dic, discharges_dic, start_date=None, end_date=None):
+        """https://www.amcharts.com/demos/population-pyramid/
+
+        Admissions and discharges per day, {date: count} or pandas Series,
+        from start_date to end_date included, all the days with any of them
+        by default.
+        """
+        import pandas as pd
+        admissions = pd.Series(admissions_dic, dtype='int64')
+        discharges = pd.Series(discharges_dic, dtype='int64')
+        dates = admissions.index.append(discharges.index)
+        if len(dates) == 0 and (start_date is None or end_date is None):
+            return []
+        start_date = start_date if start_date is not None else dates.min()
+        end_date = end_date if end_date is not None else dates.max()
+        # every day of the range, days without records count zero
+        days = pd.date_range(start_date, end_date, freq='D')
+        admissions = admissions.reindex(days, fill_value=0)
+        discharges = discharges.reindex(days, fill_value=0)
+        chart_data = [{"fecha": d.strftime("%d/%m/%y"),
+                       "ingresos": int(a),
+                       "egresos": int(e)}
+                      for (d, a, e) in zip(days, admissions.to_numpy(), discharges.to_numpy())]
         return chart_data
 
 if __name__ == '__main__':
@@ -37,90 +37,351 @@ from os.path import (join, dirname, exists)
 sys.path.append(join(dirname(__file__), ".", ".."))
 
 from c19mining.covid import MedNotesMiner
-from c19mining.utils import extractions_dir
+from c19mining.utils import (extractions_dir, lexicon_registry, parse_day)
+from c19mining.sinks import JSONFileSink
 
 import re
+import hashlib
+import logging
 import simplejson as json
-from bs4 import BeautifulSoup
-from datetime import datetime
+import xml.etree.ElementTree as ET
+from collections import deque
+
+# bump when the layout of the row index changes
+INDEX_VERSION = 1
+ROW_RE = re.compile(rb'<ROW\b.*?</ROW>', re.S)
+ENCODING_RE = re.compile(rb'<\?xml[^>]*encoding=["\']([\w.-]+)["\']')
+# columns a record needs to be mined
+NOTE_COLUMNS = ['CHN', 'NAME', 'SURNAME1', 'SURNAME2', 'INSERT_DATE',
+                'NOTA_INICIAL_URGENCIAS']
+# title and text of each section of the HL7 note, never crossing into the
+# next section. The first one has no <section> opener, the CDATA starts
+# inside it (see the example above)
+SECTION_RE = re.compile(r'<title>((?:(?!</title>).)*)</title>'
+                        r'(?:(?!</section>|<title>).)*?<text>(.*?)</text>', re.S)
+TAG_RE = re.compile(r'<.*?>')
+# section texts with nothing to mine
+EMPTY_SECTIONS = set(['no hay información para mostrar.'])
+
+
+def split_sections(note):
+    """yield (title, text) of each section of a note, without a DOM"""
+    for m in SECTION_RE.finditer(note):
+        yield (m.group(1).strip(), m.group(2))
 
 class XMLParser(object):
-    """docstring for XMLParser"""
-    def __init__(self, inputxml):
+    """Streaming reader of SEDESA XML exports, one ROW in memory at a time.
+
+    The first pass over an export builds a row index, stored next to it as
+    <export>.idx, with one entry per ROW:
+
+        [byte offset, byte length, columns, CHN, INSERT_DATE, content hash]
+
+    The index is valid while the export keeps its size and mtime. Later
+    passes, even from another XMLParser, answer from the index or seek
+    straight to the rows.
+
+    Only the sections of the notes titled as one of sections are mined,
+    all of them by default.
+    """
+    def __init__(self, inputxml, sections=None):
         super(XMLParser, self).__init__()
+        self.inputxml = inputxml
+        self.sections = set(title.lower() for title in sections) if sections else None
+        self.index_path = inputxml+'.idx'
         self.extractions_dir = extractions_dir()
-        infile = open(inputxml, 'r')
-        contents = infile.read()
-        self.xmlsoup = BeautifulSoup(contents, 'xml')
+        self.encoding = 'utf-8'
+        self.index = self.load_index()
+
+    def rows(self):
+        """yield each ROW as a record, a dict of its column texts by NAME"""
+        if self.index is not None:
+            with open(self.inputxml, 'rb') as f:
+                for (offset, length, *_) in self.index:
+                    f.seek(offset)
+                    yield self.parse_row(f.read(length))
+            return
+        index = []
+        for (offset, fragment) in self.scan():
+            row = self.parse_row(fragment)
+            index.append([offset, len(fragment), len(row),
+                          row.get('CHN'), row.get('INSERT_DATE'),
+                          hashlib.blake2b(fragment, digest_size=8).hexdigest()])
+            yield row
+        self.index = index
+        self.save_index()
+
+    def row_index(self):
+        """the row index, built with one pass over the export if needed"""
+        if self.index is None:
+            for row in self.rows():
+                pass
+        return self.index
+
+    def scan(self, chunk_size=1 << 20):
+        """yield (byte offset, bytes) of each ROW element of the export"""
+        with open(self.inputxml, 'rb') as f:
+            buffer = f.read(chunk_size)
+            m = ENCODING_RE.match(buffer)
+            if m:
+                self.encoding = m.group(1).decode('ascii')
+            consumed = 0
+            while buffer:
+                position = 0
+                for m in ROW_RE.finditer(buffer):
+                    yield (consumed + m.start(), m.group())
+                    position = m.end()
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                # keep the unfinished row for the next round
+                consumed += position
+                buffer = buffer[position:] + chunk
+
+    def parse_row(self, fragment):
+        """{NAME: text} of the columns of a ROW, a broken ROW has none"""
+        try:
+            row = ET.fromstring(fragment.decode(self.encoding))
+        except (ET.ParseError, UnicodeDecodeError):
+            return dict()
+        return {col.get('NAME'): col.text or '' for col in row.iter('COLUMN')}
+
+    def load_index(self):
+        """the stored row index if it is up to date with the export"""
+        try:
+            with open(self.index_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        stat = os.stat(self.inputxml)
+        if (stored.get('version') != INDEX_VERSION or stored.get('size') != stat.st_size
+                or stored.get('mtime') != stat.st_mtime_ns):
+            return None
+        self.encoding = stored['encoding']
+        return stored['rows']
+
+    def save_index(self):
+        stat = os.stat(self.inputxml)
+        stored = {'version': INDEX_VERSION,
+                  'size': stat.st_size,
+                  'mtime': stat.st_mtime_ns,
+                  'encoding': self.encoding,
+                  'rows': self.index}
+        try:
+            with open(self.index_path, 'w') as f:
+                json.dump(stored, f)
+        except OSError:
+            # read only upload directory, keep the index in memory only
+            pass
 
     def count_valid_records(self, expected_fields):
         """Count how many records are readable (valid)"""
         counter = 0
-        for row in self.xmlsoup.find_all('ROW'):
-            fields = [col for col in row.find_all('COLUMN')]
-            if len(fields) == expected_fields:
+        for (_, _, columns, *_) in self.row_index():
+            if columns == expected_fields:
                 counter += 1
         return counter
 
     def datestamps(self):
+        """{date: number of records} of the INSERT_DATE column, records
+        whose date can't be read are logged"""
+        import pandas as pd
+        dates = pd.Series([t for (_, _, _, _, t, _) in self.row_index() if t],
+                          dtype='object')
+        # '30/03/20 15:46:20.668000000', only the day matters and an export
+        # spans a few days, so each distinct day is parsed once
+        counts = dates.str.strip().str.split(' ', n=1).str[0].value_counts()
         stamps = dict()
-        for row in self.xmlsoup.find_all('ROW'):
-            fields = [col for col in row.find_all('COLUMN')]
-            for f in fields:
-                m = re.search('INSERT_DATE', str(f))
-                if m:
-                    t = f.get_text()
-                    date_str = t.split(' ')[0]
-                    time_str = t.split(' ')[1]
-                    date = datetime(int(date_str.split('/')[2]),
-                                    int(date_str.split('/')[1]),
-                                    int(date_str.split('/')[0]),
-                                    )
-                    if date in stamps.keys():
-                        stamps[date]+= 1
-                    else:
-                        stamps[date] = 1        
+        unknown = dict()
+        for (day, count) in counts.items():
+            stamp = parse_day(day)
+            if stamp is None:
+                unknown[day] = int(count)
+            else:
+                # '30/03/20' and '2020-03-30' are the same day
+                stamps[stamp] = stamps.get(stamp, 0) + int(count)
+        if unknown:
+            logging.warning('{} records of {} without a valid INSERT_DATE, e.g. {}'.format(
+                sum(unknown.values()), self.inputxml, list(unknown)[:3]))
         return stamps
 
-    def covid_extraction(self, outputdir=None):
-        """Read each record from an XML to extract covid insights"""
-        for row in self.xmlsoup.find_all('ROW'):
-        # it could fail for a particular row because XML is dirty
-            try:
-                (chn, name, surname1, surname2, 
-                insert_data, nota_inicial_urgencias) = (col.get_text() 
-                for col in row.find_all('COLUMN'))
-                # clean tags inside pseudo-free text
-                soup = BeautifulSoup(nota_inicial_urgencias)
-                notags_text = re.sub(r"<.*?>", " ", nota_inicial_urgencias)
-                # TODO: dirty lines from SEDESA XML
-                # print(notags_text)
-                # Information Extraction on free text
-                covid_seeker = MedNotesMiner(notags_text,
-                    {'NHC': chn,
-                     'Nombre': name,
-                     'Apellido Paterno':surname1,
-                     'Apellido Materno': surname2,
-                     'Fecha de Ingreso': insert_data
-                    })
-                covid_seeker.check_covid19()
-                covid_seeker.check_symptoms()
-                covid_seeker.check_sampling()
-                covid_seeker.check_decease()
-                covid_seeker.check_comorbidities()
-                covid_seeker.check_drugs()
-                covid_insights =  json.dumps(covid_seeker.clues, ensure_ascii=False, encoding='utf-8', indent=2)
-                print(covid_insights)
-                # store extractions into JSON files
-                if not exists(outputdir):
-                    os.makedirs(outputdir)
-                # store into a JSON file
-                fname = 'NHC_{}_{}_Cabrera'.format(chn, (insert_data.split(' ')[0]).replace('/',''))
-                inserver_path = join(outputdir, fname+'.JSON')
-                with open(inserver_path, 'w') as wf:
-                    wf.write(covid_insights)
-            except ValueError as e:
+    def covid_extraction(self, outputdir=None, workers=1, max_pending=None, sink=None,
+                         checkpoint=None, commit_every=1000, cache=None):
+        """Read each record from an XML to extract covid insights.
+
+        workers > 1 mines the records in a pool of processes with at most
+        max_pending records in flight. The clues of each record go to the
+        sink as soon as they are mined, in export order, one JSON file per
+        record in outputdir by default. The sink is closed at the end.
+
+        checkpoint is the path of a Checkpoint manifest. Records already in
+        it, mined with the current lexicons, are skipped, and the records
+        mined are committed to it every commit_every records, once the sink
+        has flushed them. An interrupted extraction resumes from its last
+        commit and a new export only costs its new or changed records.
+        With a MiningCache, notes already mined for any record are not
+        mined again.
+
+        Broken records and notes that fail to mine are logged and returned
+        in the summary instead of stopping the extraction:
+
+            {'notas': written notes, 'omitidas': records already mined,
+             'errores': [{'fila', 'NHC', 'error'}]}
+        """
+        if sink is None:
+            sink = JSONFileSink(outputdir if outputdir else self.extractions_dir)
+        if checkpoint is not None:
+            checkpoint = Checkpoint(checkpoint, lexicon_registry().version())
+        errors = []
+        skipped = 0
+        # rows sent to the pool, results come back in the same order
+        submitted = deque()
+
+        def notes():
+            nonlocal skipped
+            for (n, text, init_data, sections) in self.numbered_notes(errors):
+                key = Checkpoint.key(init_data, text)
+                if checkpoint is not None and key in checkpoint:
+                    skipped += 1
+                    continue
+                submitted.append((n, init_data['NHC'], key))
+                yield (text, init_data, sections)
+
+        written = 0
+        try:
+            with sink:
+                for clues in MedNotesMiner.mine_batch(notes(), workers, max_pending,
+                                                      return_exceptions=True, cache=cache):
+                    (n, chn, key) = submitted.popleft()
+                    if isinstance(clues, Exception):
+                        errors.append({'fila': n, 'NHC': chn, 'error': repr(clues)})
+                        continue
+                    sink.write(clues)
+                    written += 1
+                    if checkpoint is not None:
+                        checkpoint.add(key)
+                        if len(checkpoint.pending) >= commit_every:
+                            sink.flush()
+                            checkpoint.commit()
+        finally:
+            # the sink is closed, everything written is on disk
+            if checkpoint is not None:
+                checkpoint.commit()
+
+        errors.sort(key=lambda error: error['fila'])
+        for error in errors:
+            logging.warning('{}: row {} (NHC {}) not mined, {}'.format(
+                self.inputxml, error['fila'], error['NHC'], error['error']))
+        logging.info('{}: {} notes mined, {} already mined, {} errors'.format(
+            self.inputxml, written, skipped, len(errors)))
+        if cache is not None:
+            logging.info('{}: mining cache {}'.format(self.inputxml, cache.stats()))
+        return {'notas': written, 'omitidas': skipped, 'errores': errors}
+
+    def notes(self):
+        """yield (text, init_data) for each readable record"""
+        for (_, text, init_data, _) in self.numbered_notes():
+            yield (text, init_data)
+
+    def numbered_notes(self, errors=None):
+        """yield (row number, text, init_data, sections) for each readable
+        record, records that can't be read are added to the errors list if
+        given"""
+        for (n, row) in enumerate(self.rows()):
+            # it could fail for a particular row because XML is dirty
+            missing = [column for column in NOTE_COLUMNS if column not in row]
+            if missing:
+                if errors is not None:
+                    errors.append({'fila': n,
+                                   'NHC': row.get('CHN'),
+                                   'error': 'missing columns {}'.format(', '.join(missing))})
                 continue
+            (text, sections) = self.note_text(row['NOTA_INICIAL_URGENCIAS'])
+            yield (n, text,
+                   {'NHC': row['CHN'],
+                    'Nombre': row['NAME'],
+                    'Apellido Paterno': row['SURNAME1'],
+                    'Apellido Materno': row['SURNAME2'],
+                    'Fecha de Ingreso': row['INSERT_DATE']
+                   }, sections)
+
+    def note_text(self, note):
+        """(text, sections) to mine from a note, the text of the wanted
+        sections one per line and the (title, start offset) of each one.
+
+        A note without sections is mined whole and has no sections.
+        """
+        pieces = []
+        sections = []
+        position = 0
+        found = False
+        for (title, text) in split_sections(note):
+            found = True
+            if self.sections is not None and title.lower() not in self.sections:
+                continue
+            # clean tags inside pseudo-free text
+            text = TAG_RE.sub(' ', text).strip()
+            if not text or text.lower() in EMPTY_SECTIONS:
+                continue
+            sections.append((title, position))
+            pieces.append(text)
+            position += len(text) + 1
+        if not found:
+            return (TAG_RE.sub(' ', note), None)
+        return ('\n'.join(pieces), sections)
+
+
+class Checkpoint(object):
+    """Manifest of the records already mined, a tab separated line each:
+
+        CHN  INSERT_DATE  note hash  lexicon version
+
+    Lines are only appended, by commit(). Records mined with other lexicons
+    don't count as mined.
+    """
+    def __init__(self, path, lexicon_version):
+        super(Checkpoint, self).__init__()
+        self.path = path
+        self.lexicon_version = lexicon_version
+        self.mined = set()
+        self.pending = []
+        if exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    fields = tuple(line.rstrip('\n').split('\t'))
+                    if len(fields) == 4 and fields[3] == lexicon_version:
+                        self.mined.add(fields[:3])
+
+    @staticmethod
+    def key(init_data, text):
+        """(CHN, INSERT_DATE, note hash) of a record as yielded by notes()"""
+        return (init_data['NHC'], init_data['Fecha de Ingreso'],
+                hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest())
+
+    def __contains__(self, key):
+        return key in self.mined
+
+    def __len__(self):
+        return len(self.mined)
+
+    def add(self, key):
+        """mark a record as mined, it is saved on the next commit"""
+        self.pending.append(key)
+
+    def commit(self):
+        if not self.pending:
+            return
+        directory = dirname(self.path)
+        if directory and not exists(directory):
+            os.makedirs(directory)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join('\t'.join(key + (self.lexicon_version,))+'\n'
+                            for key in self.pending))
+            f.flush()
+            os.fsync(f.fileno())
+        self.mined.update(self.pending)
+        self.pending = []
+
 
 if __name__ == '__main__':
     inputxml = sys.argv[1]
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Output sinks for the clues mined by MedNotesMiner. A sink is given the
+# clues of each note with write(clues), flush() makes everything written so
+# far durable and close() must be called when the extraction ends, every
+# sink is also a context manager.
+
+import sys
+import os
+from os.path import (join, dirname, exists, isdir)
+sys.path.append(join(dirname(__file__), ".", ".."))
+
+from c19mining.utils import explore_dir
+from c19mining.store import ExtractionStore
+import gzip
+import re
+import simplejson as json
+
+# extensions read back by read_extractions
+JSON_EXTENSION = '.JSON'
+JSONL_EXTENSIONS = ('.jsonl', '.jsonl.gz')
+# shards of notes moved out of the clues
+TEXTS_INFIX = '-textos-'
+
+
+class JSONFileSink(object):
+    """one indented NHC_<chn>_<date>_Cabrera.JSON file per note"""
+    def __init__(self, outputdir):
+        super(JSONFileSink, self).__init__()
+        self.outputdir = outputdir
+        if not exists(outputdir):
+            os.makedirs(outputdir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, clues):
+        covid_insights =  json.dumps(clues, ensure_ascii=False, encoding='utf-8', indent=2)
+        fname = 'NHC_{}_{}_Cabrera'.format(clues['NHC'], (clues['Fecha de Ingreso'].split(' ')[0]).replace('/',''))
+        with open(join(self.outputdir, fname+JSON_EXTENSION), 'w') as wf:
+            wf.write(covid_insights)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class GzipShard(object):
+    """Text file written as a run of gzip members.
+
+    Lines are compressed buffer_size bytes at a time and flush() ends the
+    current member, so everything flushed can be read back while the shard
+    is still open, or after the writer was killed.
+    """
+    def __init__(self, path, buffer_size=1 << 20, compresslevel=6):
+        super(GzipShard, self).__init__()
+        self.file = open(path, 'xb')
+        self.name = path
+        self.buffer_size = buffer_size
+        self.compresslevel = compresslevel
+        self.pending = []
+        self.pending_bytes = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+        if self.pending_bytes >= self.buffer_size:
+            self.end_member()
+
+    def end_member(self):
+        if self.pending:
+            self.file.write(gzip.compress(b''.join(self.pending), self.compresslevel))
+            self.pending = []
+            self.pending_bytes = 0
+
+    def flush(self):
+        self.end_member()
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.end_member()
+        self.file.close()
+
+
+class JSONLinesSink(object):
+    """Notes as JSON lines in shards prefix-00000.jsonl, prefix-00001.jsonl ...
+
+    Numbering goes on after the highest shard already in outputdir, and
+    shards are only ever created, never overwritten. A new shard starts
+    once the current one holds max_bytes of UTF-8 encoded JSON, counted
+    before compression. compress=True writes gzip shards (.jsonl.gz), see
+    GzipShard. texts tells what to do with the note under 'texto':
+
+        'keep'      leave it in the clues
+        'drop'      remove it
+        'external'  move it to prefix-textos-00000.jsonl ..., line by line
+                    aligned with the clues shard of the same number
+    """
+    def __init__(self, outputdir, prefix='extracciones', compress=False,
+                 max_bytes=64 << 20, buffer_size=1 << 20, texts='keep'):
+        super(JSONLinesSink, self).__init__()
+        if texts not in ('keep', 'drop', 'external'):
+            raise ValueError('texts must be keep, drop or external: {}'.format(texts))
+        self.outputdir = outputdir
+        self.prefix = prefix
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        self.texts = texts
+        self.shards = []
+        self.shard = None
+        self.texts_shard = None
+        self.shard_bytes = 0
+        if not exists(outputdir):
+            os.makedirs(outputdir)
+        shard_re = re.compile(r'{}(?:{})?(\d+)\.jsonl(?:\.gz)?$'.format(
+            re.escape(prefix+'-'), re.escape(TEXTS_INFIX[1:])))
+        numbers = [int(m.group(1)) for m in map(shard_re.match, os.listdir(outputdir)) if m]
+        self.first_shard = max(numbers) + 1 if numbers else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open_shard(self, name):
+        path = join(self.outputdir, name + JSONL_EXTENSIONS[1 if self.compress else 0])
+        if self.compress:
+            return GzipShard(path, self.buffer_size)
+        return open(path, 'x', encoding='utf-8', buffering=self.buffer_size)
+
+    def rotate(self):
+        self.close()
+        number = self.first_shard + len(self.shards)
+        self.shard = self.open_shard('{}-{:05d}'.format(self.prefix, number))
+        self.shards.append(self.shard.name)
+        if self.texts == 'external':
+            self.texts_shard = self.open_shard('{}{}{:05d}'.format(self.prefix, TEXTS_INFIX, number))
+        self.shard_bytes = 0
+
+    def write(self, clues):
+        if self.shard is None or self.shard_bytes >= self.max_bytes:
+            self.rotate()
+        if self.texts != 'keep':
+            clues = dict(clues)
+            text = clues.pop('texto', None)
+            if self.texts == 'external':
+                self.texts_shard.write(json.dumps({'NHC': clues.get('NHC'), 'texto': text},
+                                                  ensure_ascii=False)+'\n')
+        line = json.dumps(clues, ensure_ascii=False)+'\n'
+        self.shard.write(line)
+        self.shard_bytes += len(line.encode('utf-8'))
+
+    def flush(self):
+        for shard in (self.shard, self.texts_shard):
+            if shard:
+                shard.flush()
+                os.fsync(shard.fileno())
+
+    def close(self):
+        for shard in (self.shard, self.texts_shard):
+            if shard:
+                shard.close()
+        self.shard = None
+        self.texts_shard = None
+
+
+class SQLiteSink(object):
+    """Notes in an ExtractionStore, given by itself or by its path.
+
+    Notes are inserted batch_size at a time, each batch in one transaction,
+    flush() inserts the ones still pending. texts='drop' leaves the notes
+    out of the store.
+    """
+    def __init__(self, store, batch_size=1000, texts='keep'):
+        super(SQLiteSink, self).__init__()
+        if texts not in ('keep', 'drop'):
+            raise ValueError('texts must be keep or drop: {}'.format(texts))
+        self.owned = not isinstance(store, ExtractionStore)
+        self.store = ExtractionStore(store) if self.owned else store
+        self.batch_size = batch_size
+        self.texts = texts
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, clues):
+        self.pending.append(clues)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.store.add_many(self.pending, keep_text=self.texts == 'keep')
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.owned:
+            self.store.close()
+
+
+def read_jsonl(path):
+    """yield the clues of each line of a .jsonl or .jsonl.gz shard, leaving
+    out a last line still being written or cut short by a killed writer"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                if not line.endswith('\n'):
+                    try:
+                        clues = json.loads(line)
+                    except ValueError:
+                        return
+                    yield clues
+                    continue
+                yield json.loads(line)
+        except EOFError:
+            # a gzip member without its end of stream marker
+            return
+
+def read_extraction_file(path):
+    """yield the clues stored in one JSON file or JSON lines shard"""
+    if path.endswith(JSONL_EXTENSIONS):
+        yield from read_jsonl(path)
+    else:
+        with open(path) as fp:
+            yield json.load(fp, encoding='utf-8')
+
+def extraction_files(path):
+    """the files with clues stored by any sink in a directory, in the order
+    they are read, none if path does not exist yet"""
+    if not exists(path):
+        return []
+    if not isdir(path):
+        return [path]
+    files = [file_path for (file_path, _) in explore_dir(path, yield_extension=JSON_EXTENSION)]
+    for extension in JSONL_EXTENSIONS:
+        for (file_path, fname) in explore_dir(path, yield_extension=extension):
+            # externalised notes are not clues
+            if TEXTS_INFIX not in fname:
+                files.append(file_path)
+    return files
+
+def read_extractions(path):
+    """yield the clues stored by any sink in a directory, or in one file"""
+    for file_path in extraction_files(path):
+        yield from read_extraction_file(file_path)
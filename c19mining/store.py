@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+# Created by Alex Molina
+# April 2020
+#
+# This project is licensed under the MIT License - see the LICENSE file for details.
+# Copyright (c) 2020 Alejandro Molina Villegas
+#
+# Embedded SQLite store of the clues mined by MedNotesMiner. Notes, the
+# concept codes and the mentions of each code in each note live in their
+# own tables, indexed by patient, admission day and code.
+
+import sys
+import os
+from os.path import (join, dirname, exists)
+sys.path.append(join(dirname(__file__), ".", ".."))
+
+from c19mining.utils import (CLUE_CATEGORIES, LISTED_CLUES, WIKIDATA_URL, parse_day)
+import sqlite3
+import threading
+
+# files taken as stores instead of extraction directories
+STORE_EXTENSIONS = ('.sqlite', '.db')
+# notes read from the database at a time
+READ_PAGE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nhc TEXT NOT NULL,
+    name TEXT,
+    surname1 TEXT,
+    surname2 TEXT,
+    insert_date TEXT NOT NULL,
+    day TEXT,
+    text TEXT,
+    UNIQUE (nhc, insert_date)
+);
+CREATE TABLE IF NOT EXISTS codes (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    code TEXT NOT NULL,
+    UNIQUE (category, code)
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    id INTEGER PRIMARY KEY,
+    note_id INTEGER NOT NULL REFERENCES notes (id) ON DELETE CASCADE,
+    code_id INTEGER NOT NULL REFERENCES codes (id),
+    description TEXT,
+    context TEXT,
+    start INTEGER,
+    end INTEGER,
+    section TEXT
+);
+CREATE INDEX IF NOT EXISTS notes_nhc ON notes (nhc);
+CREATE INDEX IF NOT EXISTS notes_day ON notes (day);
+CREATE INDEX IF NOT EXISTS mentions_code ON mentions (code_id, note_id);
+CREATE INDEX IF NOT EXISTS mentions_note ON mentions (note_id);
+'''
+
+
+def is_store(path):
+    return str(path).endswith(STORE_EXTENSIONS)
+
+def admission_day(insert_date):
+    """ISO day of an INSERT_DATE like '30/03/20 15:46:20.668000000', None
+    if it is not a date"""
+    day = parse_day(insert_date)
+    return day.date().isoformat() if day else None
+
+
+class ExtractionStore(object):
+    """Notes, codes and mentions in a SQLite database.
+
+    A note is identified by its NHC and Fecha de Ingreso, adding it again
+    replaces it. Notes get increasing ids, never reused even by the
+    replacement of the last note, so a reader can ask only for the notes
+    added after the last one it saw.
+    """
+    def __init__(self, path):
+        super(ExtractionStore, self).__init__()
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = None
+        # (category, code): id of the codes table
+        self.code_ids = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        """the database connection, opened on first use by any thread"""
+        with self.lock:
+            if self.connection is None:
+                directory = dirname(self.path)
+                if directory and not exists(directory):
+                    os.makedirs(directory)
+                self.connection = sqlite3.connect(self.path, timeout=30,
+                                                  check_same_thread=False)
+                self.connection.execute('PRAGMA journal_mode=WAL')
+                self.connection.execute('PRAGMA foreign_keys=ON')
+                self.connection.executescript(SCHEMA)
+                self.code_ids = {(category, code): code_id for (code_id, category, code)
+                                 in self.connection.execute('SELECT id, category, code FROM codes')}
+            return self.connection
+
+    def code_id(self, category, code):
+        key = (category, code)
+        if key not in self.code_ids:
+            cursor = self.connection.execute('INSERT INTO codes (category, code) VALUES (?, ?)', key)
+            self.code_ids[key] = cursor.lastrowid
+        return self.code_ids[key]
+
+    def add_many(self, notes, keep_text=True):
+        """add the clues of many notes in a single transaction"""
+        with self.lock:
+            connection = self.connect()
+            # codes added by a batch that fails are rolled back with it
+            code_ids = dict(self.code_ids)
+            try:
+                with connection:
+                    for clues in notes:
+                        self.insert(clues, keep_text)
+            except:
+                self.code_ids = code_ids
+                raise
+
+    def add(self, clues, keep_text=True):
+        self.add_many([clues], keep_text)
+
+    def insert(self, clues, keep_text=True):
+        self.connection.execute('DELETE FROM notes WHERE nhc = ? AND insert_date = ?',
+                                (clues['NHC'], clues['Fecha de Ingreso']))
+        note_id = self.connection.execute(
+            'INSERT INTO notes (nhc, name, surname1, surname2, insert_date, day, text) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (clues['NHC'], clues.get('Nombre'), clues.get('Apellido Paterno'),
+             clues.get('Apellido Materno'), clues['Fecha de Ingreso'],
+             admission_day(clues['Fecha de Ingreso']),
+             clues.get('texto') if keep_text else None)).lastrowid
+        rows = []
+        for category in CLUE_CATEGORIES:
+            if category in LISTED_CLUES:
+                code_id = self.code_id(category, '')
+                rows.extend((note_id, code_id, None, info.get('mención'))
+                            + tuple(info.get('posición', (None, None))) + (info.get('sección'),)
+                            for info in clues.get(category, []))
+                continue
+            for (code, infos) in clues.get(category, {}).items():
+                code_id = self.code_id(category, code)
+                rows.extend((note_id, code_id, info.get('descripción'), info.get('mención'))
+                            + tuple(info.get('posición', (None, None))) + (info.get('sección'),)
+                            for info in infos)
+        self.connection.executemany(
+            'INSERT INTO mentions (note_id, code_id, description, context, start, end, section) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def where(self, after_id=0, desde=None, hasta=None):
+        """SQL condition and parameters on notes n"""
+        conditions = ['n.id > ?']
+        parameters = [after_id]
+        if desde is not None:
+            conditions.append('n.day >= ?')
+            parameters.append(desde.isoformat()[:10])
+        if hasta is not None:
+            conditions.append('n.day <= ?')
+            parameters.append(hasta.isoformat()[:10])
+        return (' AND '.join(conditions), parameters)
+
+    def read(self, after_id=0, desde=None, hasta=None):
+        """yield (id, clues) of the notes in id order, only those after
+        after_id and admitted from desde to hasta, dates included"""
+        page = self.read_page(after_id, desde, hasta)
+        while page:
+            # the lock is not held while the page is consumed
+            for (note_id, clues) in page:
+                yield (note_id, clues)
+            page = self.read_page(note_id, desde, hasta)
+
+    def read_page(self, after_id, desde, hasta):
+        """(id, clues) of the next READ_PAGE notes after after_id"""
+        with self.lock:
+            connection = self.connect()
+            (where, parameters) = self.where(after_id, desde, hasta)
+            notes = connection.execute(
+                'SELECT n.id, n.nhc, n.name, n.surname1, n.surname2, n.insert_date, n.text '
+                'FROM notes n WHERE {} ORDER BY n.id LIMIT ?'.format(where),
+                parameters + [READ_PAGE]).fetchall()
+            if not notes:
+                return []
+            mentions = connection.execute(
+                'SELECT m.note_id, c.category, c.code, m.description, m.context, m.start, m.end, m.section '
+                'FROM notes n JOIN mentions m ON m.note_id = n.id JOIN codes c ON c.id = m.code_id '
+                'WHERE {} AND n.id <= ? ORDER BY m.note_id, m.id'.format(where),
+                parameters + [notes[-1][0]])
+            page = []
+            mention = next(mentions, None)
+            for (note_id, nhc, name, surname1, surname2, insert_date, text) in notes:
+                clues = {'NHC': nhc, 'Nombre': name, 'Apellido Paterno': surname1,
+                         'Apellido Materno': surname2, 'Fecha de Ingreso': insert_date}
+                if text is not None:
+                    clues['texto'] = text
+                for category in CLUE_CATEGORIES:
+                    clues[category] = [] if category in LISTED_CLUES else {}
+                while mention is not None and mention[0] == note_id:
+                    self.add_mention(clues, *mention[1:])
+                    mention = next(mentions, None)
+                page.append((note_id, clues))
+            return page
+
+    def add_mention(self, clues, category, code, description, context, start, end, section):
+        info = {'mención': context, 'posición': [start, end]}
+        if category in LISTED_CLUES:
+            clues[category].append(info)
+        else:
+            info['descripción'] = description
+            if category == 'medicamentos':
+                info['SAICA'] = code
+            else:
+                info['wikidata'] = WIKIDATA_URL+code
+            clues[category].setdefault(code, []).append(info)
+        if section is not None:
+            info['sección'] = section
+
+    def find_notes(self, codes=(), desde=None, hasta=None):
+        """(NHC, Fecha de Ingreso) of the notes with every one of codes,
+        e.g. ['Q12206', 'Q38933'], admitted from desde to hasta"""
+        with self.lock:
+            connection = self.connect()
+            (where, parameters) = self.where(0, desde, hasta)
+            for code in codes:
+                where += (' AND EXISTS (SELECT 1 FROM mentions m JOIN codes c ON c.id = m.code_id'
+                          ' WHERE m.note_id = n.id AND c.code = ?)')
+                parameters.append(code)
+            return connection.execute('SELECT n.nhc, n.insert_date FROM notes n WHERE {} '
+                                      'ORDER BY n.id'.format(where), parameters).fetchall()
+
+    def last_id(self):
+        with self.lock:
+            return self.connect().execute('SELECT COALESCE(MAX(id), 0) FROM notes').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
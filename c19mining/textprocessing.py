@@ -10,59 +10,144 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), ".", ".."))
 
-from c19mining.utils import (wiki_deseases_regex, wiki_symptoms_regex, drugs_regex)
+from c19mining.utils import (lexicon_registry, explore_dir, pool_imap)
+from c19mining.gazetteer import (TOKEN_RE, TokenIndex)
 import re
+import threading
 from os.path import exists
-from mosestokenizer import *
 
-import nltk
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-from nltk import word_tokenize
+# pure Python engine: a sentence ends at . ! or ? followed by blanks and the
+# start of a new sentence, unless the dot belongs to an abbreviation
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+(?=[¿¡"(\w])')
+ABBREVIATIONS = set(['dr', 'dra', 'sr', 'sra', 'srta', 'hrs', 'hr', 'min',
+                     'mg', 'ml', 'kg', 'aprox', 'etc', 'núm', 'tel',
+                     'ej', 'pág', 'vs', 'ud', 'uds', 'lic', 'ing'])
+# abbreviations only before a number, 'No. 3' but not 'Refiere que no.'
+NUMBER_ABBREVIATIONS = set(['no'])
+DETOKENIZE_RE = re.compile(r' ([,.;:!?)\]}%]|\.\.+)|([(\[{¿¡]) ')
+
+# OpenNLP entity types, the first one wins between equally long mentions
+ENTITY_TYPES = ['Desease', 'Symptom', 'Drug']
+
+
+def moses():
+    """import mosestokenizer on first use, its tools run Perl subprocesses"""
+    try:
+        import mosestokenizer
+    except ImportError as e:
+        raise ImportError('mosestokenizer is needed to split sentences and '
+                          'detokenize: pip install mosestokenizer') from e
+    return mosestokenizer
 
 
 class Tokenizer(object):
-    """tokenize detokenize and split sentsences from text"""
-    def __init__(self, lang='es'):
+    """tokenize detokenize and split sentsences from text
+
+    The Moses engine keeps one sentence splitter and one detokenizer
+    subprocess alive for the life of the Tokenizer, call close() or use it
+    in a with block to stop them. engine='python' needs no subprocess.
+    """
+    def __init__(self, lang='es', engine='moses'):
         super(Tokenizer, self).__init__()
         self.lang = lang
+        self.engine = engine
+        self.splitter = None
+        self.detokenizer = None
+        self.splitter_lock = threading.Lock()
+        self.detokenizer_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """stop the Moses subprocesses, they restart on next use"""
+        with self.splitter_lock:
+            if self.splitter:
+                self.splitter.close()
+                self.splitter = None
+        with self.detokenizer_lock:
+            if self.detokenizer:
+                self.detokenizer.close()
+                self.detokenizer = None
 
     def split_tokens(self, text):
         """Apply tokenization split, e.g.
         ...la parte de arriba son superiores ( craneales , rostrales ) , y las ...
         """
         contents = self.list_of_str(text)
-        tokens = ''
-        for line in contents:
-            if line == '\n':
-                tokens += '\n'
-            else:
-                tokens += '{}\n'.format(' '.join(word_tokenize(line)))
-        return tokens
+        return ''.join('{}\n'.format(' '.join(TOKEN_RE.findall(line)))
+                       for line in contents)
+
+    def span_tokenize(self, text):
+        """(start, end) offsets of the tokens split_tokens separates, the
+        same ones the miner reports mentions with"""
+        index = TokenIndex(text)
+        return list(zip(index.starts, index.ends))
 
     def join_tokens(self, text):
         """Undo what split_tokens does, e.g.
         ...la parte de arriba son superiores (craneales,rostrales), y las ...
         """
         contents = self.list_of_tokens(text)
-        with MosesDetokenizer(self.lang) as detokenize:
-            detokenized = '\n'.join([detokenize(tokens) for tokens in contents])
-        return detokenized
+        return '\n'.join([self.detokenize(tokens) for tokens in contents])
 
     def split_sentences(self, text):
         """Detect sentence limits and add newline characters"""
         contents = self.list_of_str(text)
-        with MosesSentenceSplitter('es') as splitsents:
-            sentences = ''
-            for line in contents:                
-                if line == '' or re.match(r'\s+', line):
-                    sentences +='\n'
-                else:
-                    sentences += '\n'.join(splitsents([line]))+'\n'
+        sentences = []
+        for line in contents:
+            if line == '' or re.match(r'\s+', line):
+                sentences.append('\n')
+            else:
+                sentences.append('\n'.join(self.sentences(line))+'\n')
+        return ''.join(sentences)
+
+    def sentences(self, line):
+        """list of sentences in a line of text"""
+        if self.engine == 'python':
+            return self.python_sentences(line)
+        with self.splitter_lock:
+            if not self.splitter:
+                self.splitter = moses().MosesSentenceSplitter(self.lang)
+            return self.splitter([line])
+
+    def python_sentences(self, line):
+        sentences = []
+        start = 0
+        for m in SENTENCE_END_RE.finditer(line):
+            words = line[start:m.start()].split()
+            last_word = words[-1].rstrip('.').lower() if words else None
+            if last_word in ABBREVIATIONS:
+                continue
+            if last_word in NUMBER_ABBREVIATIONS and line[m.end():m.end()+1].isdigit():
+                continue
+            sentences.append(line[start:m.start()])
+            start = m.end()
+        sentences.append(line[start:].rstrip())
         return sentences
 
+    def detokenize(self, tokens):
+        """join a list of tokens into a string"""
+        if self.engine == 'python':
+            return DETOKENIZE_RE.sub(lambda m: m.group(1) or m.group(2), ' '.join(tokens))
+        with self.detokenizer_lock:
+            if not self.detokenizer:
+                self.detokenizer = moses().MosesDetokenizer(self.lang)
+            return self.detokenizer(tokens)
+
+    def read_text(self, text):
+        """return the contents of a file or the string itself"""
+        if exists(text):
+            with open(text, 'r') as f:
+                return f.read()
+        return text
+
     def list_of_str(self, text):
         """return a list of strings regardless the input object type"""
         if exists(text):
@@ -84,23 +169,43 @@ class Tokenizer(object):
 
 class OpenNLPTagger(object):
     """OpenNLP Tagger for diseases and symptoms based on long lists"""
-    def __init__(self):
+    def __init__(self, engine='moses'):
         super(OpenNLPTagger, self).__init__()
-        self.symptoms_re = wiki_symptoms_regex()
-        self.deseases_re = wiki_deseases_regex()
-        self.drugs_re = drugs_regex()
-        self.tokenizer = Tokenizer()
+        self.engine = engine
+        self.entities_gz = lexicon_registry().get('entities_gz')
+        self.tokenizer = Tokenizer(engine=engine)
 
-    def tagbyreg(self, text, split_sents=False):
-        """labelize symptoms and deseases ocurrences"""
-        # depending on the object will open a file or not
+    def close(self):
+        self.tokenizer.close()
 
-        if os.path.exists(text):
-            with open(text, 'r', encoding='utf-8') as fp:
-                lower_text = (fp.read()).lower()
-        else:
-            print(text, 'KO')
-            lower_text = None
+    def spans(self, tokenized):
+        """(start, end, entity) offsets of the mentions to tag.
+
+        Overlapping mentions are resolved in favour of the longest one, they
+        never cross a line because OpenNLP reads one sentence per line, and
+        they start and end with whitespace tokens of tokenized, a tag inside
+        a token like 'post-fiebre' is not valid OpenNLP markup.
+        """
+        index = TokenIndex(tokenized)
+        taken = bytearray(len(index))
+        found = sorted(self.entities_gz.search(index.tokens),
+                       key=lambda m: (m[3] - m[4], m[3], ENTITY_TYPES.index(m[0])))
+        spans = []
+        for (entity, _, _, first, last) in found:
+            if any(taken[first:last]):
+                continue
+            (start, end) = index.span(first, last)
+            if '\n' in tokenized[start:end]:
+                continue
+            if tokenized[start-1:start].strip() or tokenized[end:end+1].strip():
+                continue
+            taken[first:last] = b'\x01' * (last - first)
+            spans.append((start, end, entity))
+        return sorted(spans)
+
+    def tagbyreg(self, text, split_sents=False):
+        """labelize symptoms and deseases ocurrences of a text or a file"""
+        lower_text = self.tokenizer.read_text(text).lower()
 
         # prepare lines and tokens
         if split_sents:
@@ -108,15 +213,56 @@ class OpenNLPTagger(object):
             tokenized = self.tokenizer.split_tokens(sentence_splitted)
         else:
             tokenized = self.tokenizer.split_tokens(lower_text)
-        #  seek for symptoms and deaseses and tagg them
-        labeled = self.deseases_re.sub(r'<START:Desease> \g<matched> <END>', tokenized)
-        labeled = self.symptoms_re.sub(r'<START:Symptom> \g<matched> <END>', labeled)
-        labeled = self.drugs_re.sub(r'<START:Drug> \g<matched> <END>', labeled)
-        # correct nasty nested tags if produced
-        nested =r'(?P<a><START:(Symptom|Desease|Drug)> (\w+ )*)<START:(Symptom|Desease|Drug)>(?P<b> (\w+ )+)<END>(?P<c> (\w+ )*<END>)'
-        corrected_labeled = re.sub(nested, r'\g<a>\g<b>\g<c>', labeled)
-        labeled_text = corrected_labeled.replace('  ',' ')
-        return(labeled_text)
+        #  seek for symptoms, deaseses and drugs and tagg them in one pass
+        labeled = []
+        position = 0
+        for (start, end, entity) in self.spans(tokenized):
+            labeled.append(tokenized[position:start])
+            labeled.append('<START:{}> {} <END>'.format(entity, tokenized[start:end]))
+            position = end
+        labeled.append(tokenized[position:])
+        return ''.join(labeled)
+
+    def tag_corpus(self, corpus_dir, output_prefix, workers=None,
+                   shard_size=10000, split_sents=False, extension='txt'):
+        """Tag every file under corpus_dir in a pool of processes.
+
+        Documents are written as OpenNLP name finder training data, one
+        blank line between documents, in shards output_prefix-00000.train,
+        output_prefix-00001.train ... of shard_size documents each.
+        Returns the list of shards.
+        """
+        output_dir = os.path.dirname(os.path.abspath(output_prefix))
+        if not exists(output_dir):
+            os.makedirs(output_dir)
+        arguments = ((path, split_sents) for (path, _) in explore_dir(corpus_dir, extension))
+        shards = []
+        shard = None
+        try:
+            for (n, tagged) in enumerate(pool_imap(tag_file, arguments, workers,
+                                                   initializer=init_tagger,
+                                                   initargs=(self.engine,))):
+                if n % shard_size == 0:
+                    if shard:
+                        shard.close()
+                    shards.append('{}-{:05d}.train'.format(output_prefix, len(shards)))
+                    shard = open(shards[-1], 'w', encoding='utf-8')
+                shard.write(tagged.strip('\n')+'\n\n')
+        finally:
+            if shard:
+                shard.close()
+        return shards
+
+
+# one tagger per worker process of tag_corpus
+_tagger = None
+
+def init_tagger(engine='moses'):
+    global _tagger
+    _tagger = OpenNLPTagger(engine)
+
+def tag_file(path, split_sents=False):
+    return _tagger.tagbyreg(path, split_sents)
 
 
 if __name__ == '__main__':
@@ -6,9 +6,66 @@
 # This project is licensed under the MIT License - see the LICENSE file for details.
 # Copyright (c) 2020 Alejandro Molina Villegas
 
-from c19mining.utils import (HOME, TEST_TEXT)
+from c19mining.utils import (HOME, TEST_TEXT, LexiconRegistry, lexicon_registry,
+                            load_txt, load_csv)
 from c19mining.covid import MedNotesMiner
+from c19mining.sedesa import (XMLParser, split_sections)
+from c19mining.sinks import (JSONLinesSink, SQLiteSink, read_extractions)
+from c19mining.store import ExtractionStore
+import c19mining.store as store_module
+from c19mining.report import (ReportGenerator, AmchartsGenerator)
+from c19mining.cache import MiningCache
+from c19mining.gazetteer import (Gazetteer, CodeTable)
+from c19mining.negation import NegationDetector
+from c19mining.textprocessing import (Tokenizer, OpenNLPTagger)
 import os
+import sys
+import subprocess
+import threading
+import pytest
+from datetime import datetime
+
+XML_ROW = '''    <ROW>
+        <COLUMN NAME="CHN"><![CDATA[{}]]></COLUMN>
+        <COLUMN NAME="NAME"><![CDATA[ALEX]]></COLUMN>
+        <COLUMN NAME="SURNAME1"><![CDATA[MOLINA]]></COLUMN>
+        <COLUMN NAME="SURNAME2"><![CDATA[VILLEGAS]]></COLUMN>
+        <COLUMN NAME="INSERT_DATE"><![CDATA[{} 15:46:20.668000000]]></COLUMN>
+        <COLUMN NAME="NOTA_INICIAL_URGENCIAS"><![CDATA[<section>
+          <title>Resultado de Escalas</title>
+          <text>No hay información para mostrar.</text>
+        </section>
+        <section>
+          <title>Resumen de Interrogatorio, Exploración Física y/o Estado Mental</title>
+          <text>{}</text>
+        </section>]]></COLUMN>
+    </ROW>
+'''
+
+def write_export(path, rows):
+    """write a small SEDESA like XML export of (chn, date, note) rows"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<RESULTS>\n')
+        for (chn, date, note) in rows:
+            f.write(XML_ROW.format(chn, date, note))
+        # a dirty record without the note column
+        f.write('    <ROW><COLUMN NAME="CHN"><![CDATA[1]]></COLUMN></ROW>\n')
+        f.write('</RESULTS>\n')
+    return str(path)
+
+def register(chn, symptoms=(), covid=(), date='30/03/20'):
+    """the clues of a mined note with symptoms and covid codes"""
+    mention = [{'descripción': 'x', 'mención': '...x...'}]
+    return {'NHC': chn, 'Nombre': 'ALEX', 'Apellido Paterno': 'MOLINA',
+            'Apellido Materno': 'VILLEGAS', 'Fecha de Ingreso': date+' 15:46:20',
+            'COVID-19': {code: mention for code in covid},
+            'síntomas': {code: mention for code in symptoms},
+            'comorbilidades': {}, 'medicamentos': {},
+            'muestreos': [], 'defunciones': []}
+
+EXPORT_ROWS = [('507314', '30/03/20', 'paciente con fiebre y tos, caso sospechoso de covid-19'),
+               ('507315', '30/03/20', 'sin fiebre, con cefalea'),
+               ('507316', '31/03/20', 'diabetes mellitus tipo 2')]
 
 
 class TestMedNotesMiner:
@@ -24,3 +81,553 @@ class TestMedNotesMiner:
         for section in ["texto", "COVID-19", "síntomas", "comorbilidades"]:
             assert section in extracted_sections
 
+    def test_extract_all(self):
+        textfile_path = os.path.join(HOME, TEST_TEXT)
+        each = MedNotesMiner(textfile_path)
+        each.check_covid19()
+        each.check_symptoms()
+        each.check_sampling()
+        each.check_decease()
+        each.check_comorbidities()
+        each.check_drugs()
+        single = MedNotesMiner(textfile_path)
+        assert single.extract_all() == each.clues
+
+    def test_context_size(self):
+        miner = MedNotesMiner('paciente con tos seca desde hace tres dias')
+        miner.check_symptoms(context_size=1)
+        assert miner.clues['síntomas']['Q35805'][0]['mención'] == '...con tos seca...'
+        miner.check_symptoms(context_size=20)
+        assert miner.clues['síntomas']['Q35805'][0]['mención'] == '...paciente con tos seca desde hace tres dias...'
+
+    def test_mention_offsets(self):
+        text = 'Paciente con FIEBRE y tos'
+        miner = MedNotesMiner(text)
+        miner.extract_all()
+        (start, end) = miner.clues['síntomas']['Q38933'][0]['posición']
+        assert text[start:end] == 'FIEBRE'
+
+    def test_mine_batch(self):
+        notes = [('fiebre y tos', {'NHC': n}) if n % 2 else ('sin fiebre, con cefalea', {'NHC': n})
+                 for n in range(12)]
+        serial = list(MedNotesMiner.mine_batch(notes, workers=1))
+        parallel = list(MedNotesMiner.mine_batch(iter(notes), workers=2, max_pending=3))
+        assert [clues['NHC'] for clues in parallel] == list(range(12))
+        assert parallel == serial
+
+    def test_shared_lexicons(self):
+        first = MedNotesMiner('fiebre y tos')
+        second = MedNotesMiner('sin fiebre')
+        assert first.lexicons is second.lexicons
+        assert first.clues_gz is second.clues_gz
+        assert first.clues_gz is lexicon_registry().get('clues_gz')
+
+    def test_compact_mentions(self):
+        miner = MedNotesMiner('paciente con fiebre, niega tos')
+        # the negated cough is left out
+        (fever,) = miner.find_mentions()
+        assert (type(fever.category), type(fever.code)) == (int, int)
+        assert not hasattr(fever, '__dict__')
+        assert miner.codes[fever.code] == 'Q38933'
+        clues = miner.render(context_size=1)
+        assert clues['síntomas'] == {'Q38933': [{'descripción': 'fiebre',
+                                                 'mención': '...con fiebre,...',
+                                                 'posición': [13, 19],
+                                                 'wikidata': 'https://www.wikidata.org/wiki/Q38933'}]}
+
+
+class TestStartup:
+
+    def test_light_import(self):
+        code = ('import sys, c19mining.covid; '
+                'print(sorted({\'pandas\', \'nltk\', \'mosestokenizer\', \'bs4\'} & set(sys.modules)))')
+        out = subprocess.run([sys.executable, '-c', code], cwd=HOME, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True)
+        assert out.stdout.strip() == '[]'
+
+
+class TestLexiconRegistry:
+
+    def test_reload_on_change(self, tmp_path):
+        resource = tmp_path / 'lexicon.txt'
+        resource.write_text('fiebre\n')
+        registry = LexiconRegistry({'words': (str(resource), load_txt)})
+        words = registry.get('words')
+        assert words == ['fiebre']
+        assert registry.get('words') is words
+        resource.write_text('fiebre\ntos\n')
+        os.utime(resource, ns=(0, os.stat(resource).st_mtime_ns + 10**9))
+        assert registry.get('words') == ['fiebre', 'tos']
+
+    def test_version(self, tmp_path):
+        resource = tmp_path / 'lexicon.txt'
+        resource.write_text('fiebre\n')
+        registry = LexiconRegistry({'words': (str(resource), load_txt)})
+        version = registry.version()
+        # the same contents with another mtime, e.g. after a checkout
+        os.utime(resource, ns=(0, os.stat(resource).st_mtime_ns + 10**9))
+        assert registry.version() == version
+        resource.write_text('tos\n')
+        assert registry.version() != version
+
+    def test_load_csv(self):
+        import pandas as pd
+        # the same (code, name) pairs pandas read before, SAICA codes
+        # included ('00103' stays a string, U00008 is in the same column)
+        for resource in ['covid19.csv', 'covid19_sintomas.csv', 'sintomas_wikidata.csv',
+                         'covid19_comorbilidades.csv', 'drogas.csv']:
+            path = os.path.join(HOME, 'resources', resource)
+            df = pd.read_csv(path, sep='\t')
+            assert load_csv(path) == list(zip(df.id, df.name))
+        assert load_csv(os.path.join(HOME, 'resources', 'drogas.csv'))[0] == ('00103', 'acido acetilsalicilico')
+
+
+class TestGazetteer:
+
+    def test_longest_match(self):
+        gazetteer = Gazetteer([('Q1', 'neumonia'), ('Q1', 'neumonia atipica'),
+                               ('Q2', 'covid-19')])
+        text = 'caso de neumonia atipica por covid-19, sin neumonia'
+        matches = list(gazetteer.finditer(text, context_size=1))
+        assert [m.name for m in matches] == ['neumonia atipica', 'covid-19', 'neumonia']
+        assert text[matches[1].start:matches[1].end] == 'covid-19'
+        assert matches[1].context == 'por covid-19,'
+
+    def test_sub(self):
+        gazetteer = Gazetteer([('Q1', 'tos')])
+        assert gazetteer.sub('<{}>', 'tos y tosferina') == '<tos> y tosferina'
+
+    def test_code_table(self):
+        codes = CodeTable(['Q38933', 'Q35805'])
+        assert codes.intern('Q35805') == 1
+        assert codes.intern('Q84263196') == 2
+        assert codes[2] == 'Q84263196'
+        assert 'Q38933' in codes and len(codes) == 3
+
+
+class TestNegationDetector:
+
+    def test_negated(self):
+        detector = NegationDetector([('sin', 'pre', 0, ['síntomas']),
+                                     ('negado', 'post', 1, ['síntomas']),
+                                     ('receptor de covid', 'excl', 2, ['COVID-19'])])
+        # sin fiebre , tos negado por hospital receptor de covid
+        # 0   1      2 3   4      5   6        7        8  9
+        scope = detector.scope('sin fiebre , tos negado por hospital receptor de covid')
+        assert scope.negated('síntomas', 1, 2)
+        assert not scope.negated('COVID-19', 1, 2)
+        assert scope.negated('síntomas', 3, 4)
+        assert not scope.negated('síntomas', 5, 6)
+        assert scope.negated('COVID-19', 9, 10)
+        # tos negado . fiebre negado
+        # 0   1      2 3      4
+        scope = detector.scope('tos negado. fiebre negado')
+        assert scope.negated('síntomas', 0, 1) and scope.negated('síntomas', 3, 4)
+        # the sentence ends before the trigger
+        assert not detector.scope('tos. negado').negated('síntomas', 0, 1)
+
+    def test_miner_negations(self):
+        miner = MedNotesMiner('sin fiebre ni tos, con cefalea. niega paracetamol')
+        clues = miner.extract_all()
+        assert list(clues['síntomas']) == ['Q86']
+        assert clues['medicamentos'] == {}
+        # from data/test/notamed.txt
+        miner = MedNotesMiner('Tabaquismo, alcoholismo,\ntoxicomanias; interrogadas y negadas.')
+        assert miner.extract_all()['comorbilidades'] == {}
+
+
+class TestTokenizer:
+
+    def test_split_tokens(self):
+        tokenizer = Tokenizer()
+        text = 'caso sospechoso (covid-19), TA 110/60 y temp. 37.1 °C...'
+        assert tokenizer.split_tokens(text) == \
+            'caso sospechoso ( covid-19 ) , TA 110/60 y temp . 37.1 ° C ...\n'
+        # punctuation between words always splits them
+        assert tokenizer.split_tokens('fiebre,tos y cefalea.Refiere') == \
+            'fiebre , tos y cefalea . Refiere\n'
+        spans = tokenizer.span_tokenize(text)
+        assert [text[start:end] for (start, end) in spans] == tokenizer.split_tokens(text).split()
+        assert spans[:3] == [(0, 4), (5, 15), (16, 17)]
+
+    def test_python_engine(self):
+        with Tokenizer(engine='python') as tokenizer:
+            text = 'Lo valora el Dr. Pérez. Refiere tos (seca) desde ayer.'
+            assert tokenizer.split_sentences(text) == \
+                'Lo valora el Dr. Pérez.\nRefiere tos (seca) desde ayer.\n'
+            assert tokenizer.split_sentences('Cama No. 3. Fiebre? Refiere que no. Tos seca.') == \
+                'Cama No. 3.\nFiebre?\nRefiere que no.\nTos seca.\n'
+            assert tokenizer.join_tokens(tokenizer.split_tokens(text)).strip() == text
+
+
+class TestOpenNLPTagger:
+
+    def test_tagbyreg(self):
+        tagger = OpenNLPTagger(engine='python')
+        tagged = tagger.tagbyreg('Neumonía por coronavirus con fiebre y diarrea.\nTos')
+        assert tagged == ('<START:Desease> neumonía por coronavirus <END> con '
+                          '<START:Symptom> fiebre <END> y <START:Symptom> diarrea <END> .\n'
+                          '<START:Symptom> tos <END>\n')
+        # tags only wrap whole tokens, punctuation next to a term is split
+        # off and a term inside a hyphenated word is left alone
+        assert tagger.tagbyreg('fiebre,tos y cefalea.disnea post-fiebre') == \
+            ('<START:Symptom> fiebre <END> , <START:Symptom> tos <END> y '
+             '<START:Symptom> cefalea <END> . <START:Symptom> disnea <END> post-fiebre\n')
+
+    def test_tag_corpus(self, tmp_path):
+        corpus = tmp_path / 'notas'
+        corpus.mkdir()
+        for n in range(5):
+            (corpus / 'nota{}.txt'.format(n)).write_text('nota {} con fiebre'.format(n))
+        tagger = OpenNLPTagger(engine='python')
+        shards = tagger.tag_corpus(str(corpus), str(tmp_path / 'ner' / 'es-ner'),
+                                   workers=2, shard_size=2)
+        assert [os.path.basename(shard) for shard in shards] == \
+            ['es-ner-00000.train', 'es-ner-00001.train', 'es-ner-00002.train']
+        with open(shards[1]) as f:
+            assert f.read() == ('nota 2 con <START:Symptom> fiebre <END>\n\n'
+                                'nota 3 con <START:Symptom> fiebre <END>\n\n')
+
+
+class TestXMLParser:
+
+    def test_streaming_rows(self, tmp_path):
+        xmlparser = XMLParser(write_export(tmp_path / 'ingresos.xml', EXPORT_ROWS))
+        assert xmlparser.count_valid_records(6) == 3
+        assert xmlparser.datestamps() == {datetime(2020, 3, 30): 2, datetime(2020, 3, 31): 1}
+        notes = list(xmlparser.notes())
+        assert [init_data['NHC'] for (_, init_data) in notes] == ['507314', '507315', '507316']
+        assert 'caso sospechoso de covid-19' in notes[0][0]
+
+    def test_datestamps_formats(self, tmp_path, caplog):
+        rows = [('1', '1/4/20', 'fiebre'), ('2', '01/04/2020', 'tos'),
+                ('3', '2020-04-02', 'tos'), ('4', 'ayer', 'tos')]
+        xmlparser = XMLParser(write_export(tmp_path / 'ingresos.xml', rows))
+        stamps = xmlparser.datestamps()
+        assert stamps == {datetime(2020, 4, 1): 2, datetime(2020, 4, 2): 1}
+        assert set(type(day) for day in stamps) == {datetime}
+        # the record that can't be counted is not dropped silently
+        assert "1 records of {} without a valid INSERT_DATE, e.g. ['ayer']".format(
+            xmlparser.inputxml) in caplog.text
+
+    def test_row_index(self, tmp_path):
+        export = write_export(tmp_path / 'ingresos.xml', EXPORT_ROWS)
+        first = XMLParser(export)
+        assert first.index is None
+        assert first.count_valid_records(6) == 3
+        assert os.path.exists(export+'.idx')
+        second = XMLParser(export)
+        assert second.index == first.index
+        assert [row[3] for row in second.index] == ['507314', '507315', '507316', '1']
+        assert list(second.notes()) == list(first.notes())
+        # a changed export invalidates its index
+        write_export(export, EXPORT_ROWS[:1])
+        os.utime(export, ns=(0, os.stat(export).st_mtime_ns + 10**9))
+        assert XMLParser(export).index is None
+
+    def test_covid_extraction(self, tmp_path):
+        xmlparser = XMLParser(write_export(tmp_path / 'ingresos.xml', EXPORT_ROWS))
+        outputdir = str(tmp_path / 'extracciones')
+        summary = xmlparser.covid_extraction(outputdir, workers=2, max_pending=2)
+        assert summary['notas'] == 3
+        assert summary['errores'] == [{'fila': 3, 'NHC': '1',
+                                       'error': 'missing columns NAME, SURNAME1, SURNAME2, '
+                                                'INSERT_DATE, NOTA_INICIAL_URGENCIAS'}]
+        assert sorted(os.listdir(outputdir)) == ['NHC_507314_300320_Cabrera.JSON',
+                                                 'NHC_507315_300320_Cabrera.JSON',
+                                                 'NHC_507316_310320_Cabrera.JSON']
+
+
+    def test_checkpoint(self, tmp_path):
+        export = write_export(tmp_path / 'ingresos.xml', EXPORT_ROWS)
+        outputdir = str(tmp_path / 'extracciones')
+        checkpoint = str(tmp_path / 'checkpoint.tsv')
+        summary = XMLParser(export).covid_extraction(outputdir, checkpoint=checkpoint, commit_every=2)
+        assert (summary['notas'], summary['omitidas']) == (3, 0)
+        summary = XMLParser(export).covid_extraction(outputdir, checkpoint=checkpoint)
+        assert (summary['notas'], summary['omitidas']) == (0, 3)
+        # only the new and the changed records are mined
+        rows = EXPORT_ROWS[:2] + [('507316', '31/03/20', 'diabetes mellitus tipo 2 y tos'),
+                                  ('507317', '01/04/20', 'fiebre')]
+        write_export(export, rows)
+        os.utime(export, ns=(0, os.stat(export).st_mtime_ns + 10**9))
+        summary = XMLParser(export).covid_extraction(outputdir, checkpoint=checkpoint)
+        assert (summary['notas'], summary['omitidas']) == (2, 2)
+        assert len(os.listdir(outputdir)) == 4
+
+    def test_sections(self, tmp_path):
+        export = write_export(tmp_path / 'ingresos.xml', EXPORT_ROWS)
+        (text, init_data) = next(XMLParser(export).notes())
+        assert text == EXPORT_ROWS[0][2]
+        outputdir = str(tmp_path / 'extracciones')
+        XMLParser(export).covid_extraction(outputdir)
+        clues = next(read_extractions(outputdir))
+        assert clues['síntomas']['Q38933'][0]['sección'].startswith('Resumen de Interrogatorio')
+        # sections out of the allow list are not mined
+        xmlparser = XMLParser(export, sections=['Resultado de Escalas'])
+        assert [text for (text, _) in xmlparser.notes()] == ['', '', '']
+
+    def test_first_section(self):
+        # the CDATA starts inside the first section, as in the SEDESA exports
+        note = ('code code="1111-1" codeSystemName="LOINC" displayName="LOINC Texto Libre" />\n'
+                '<title>Motivo de consulta</title>\n<text>fiebre y tos</text>\n'
+                '</section>\n</component>\n<component>\n<section>\n'
+                '<code code="1111-1" codeSystemName="LOINC" />\n<title>Sin texto</title>\n'
+                '</section>\n<section>\n<title>Resumen de Interrogatorio</title>\n'
+                '<text>cefalea</text>\n</section>')
+        assert list(split_sections(note)) == [('Motivo de consulta', 'fiebre y tos'),
+                                              ('Resumen de Interrogatorio', 'cefalea')]
+        assert XMLParser('ingresos.xml').note_text(note) == \
+            ('fiebre y tos\ncefalea', [('Motivo de consulta', 0), ('Resumen de Interrogatorio', 13)])
+
+class TestSinks:
+
+    def test_jsonl_shards(self, tmp_path):
+        xmlparser = XMLParser(write_export(tmp_path / 'ingresos.xml', EXPORT_ROWS))
+        outputdir = str(tmp_path / 'extracciones')
+        # one note per shard
+        sink = JSONLinesSink(outputdir, compress=True, max_bytes=1, texts='external')
+        xmlparser.covid_extraction(sink=sink)
+        assert [os.path.basename(shard) for shard in sink.shards] == [
+            'extracciones-00000.jsonl.gz', 'extracciones-00001.jsonl.gz',
+            'extracciones-00002.jsonl.gz']
+        assert os.path.exists(os.path.join(outputdir, 'extracciones-textos-00002.jsonl.gz'))
+        clues = list(read_extractions(outputdir))
+        assert [c['NHC'] for c in clues] == ['507314', '507315', '507316']
+        assert not any('texto' in c for c in clues)
+        report = ReportGenerator(outputdir, excels_dir=str(tmp_path))
+        assert list(report.df_report['NHC']) == ['507314', '507315', '507316']
+
+    def test_shard_numbers(self, tmp_path):
+        outputdir = str(tmp_path)
+        with JSONLinesSink(outputdir, max_bytes=1) as sink:
+            for chn in ['1', '2', '3']:
+                sink.write({'NHC': chn})
+        os.remove(os.path.join(outputdir, 'extracciones-00000.jsonl'))
+        # numbering goes on after the highest shard, not after their count
+        with JSONLinesSink(outputdir, max_bytes=1) as sink:
+            sink.write({'NHC': 'new'})
+        assert [os.path.basename(shard) for shard in sink.shards] == ['extracciones-00003.jsonl']
+        assert [c['NHC'] for c in read_extractions(outputdir)] == ['2', '3', 'new']
+
+    def test_missing_dir(self, tmp_path):
+        outputdir = str(tmp_path / 'extracciones')
+        # nothing was mined yet
+        assert list(read_extractions(outputdir)) == []
+        report = ReportGenerator(outputdir, excels_dir=str(tmp_path))
+        assert len(report.df_report) == 0
+
+    def test_open_shard(self, tmp_path):
+        outputdir = str(tmp_path)
+        sink = JSONLinesSink(outputdir, compress=True)
+        sink.write({'NHC': '1'})
+        sink.write({'NHC': '2'})
+        sink.flush()
+        sink.write({'NHC': '3'})
+        # what was flushed is read while the shard is still open
+        assert [c['NHC'] for c in read_extractions(outputdir)] == ['1', '2']
+        sink.close()
+        assert [c['NHC'] for c in read_extractions(outputdir)] == ['1', '2', '3']
+        # a last member cut short by a killed writer is left out
+        with open(sink.shards[0], 'rb') as f:
+            data = f.read()
+        with open(sink.shards[0], 'wb') as f:
+            f.write(data[:-10])
+        assert [c['NHC'] for c in read_extractions(outputdir)] == ['1', '2']
+
+    def test_shard_bytes(self, tmp_path):
+        with JSONLinesSink(str(tmp_path), max_bytes=16) as sink:
+            # 15 characters and 16 bytes
+            sink.write({'texto': 'é'})
+            sink.write({'texto': 'e'})
+        assert len(sink.shards) == 2
+
+
+class TestExtractionStore:
+
+    def test_round_trip(self, tmp_path):
+        xmlparser = XMLParser(write_export(tmp_path / 'ingresos.xml', EXPORT_ROWS))
+        xmlparser.covid_extraction(outputdir=str(tmp_path / 'json'))
+        store_path = str(tmp_path / 'extracciones.sqlite')
+        xmlparser.covid_extraction(sink=SQLiteSink(store_path, batch_size=2))
+        with ExtractionStore(store_path) as store:
+            stored = [clues for (_, clues) in store.read()]
+            assert stored == list(read_extractions(str(tmp_path / 'json')))
+            fever = store.find_notes(['Q38933'])
+            assert fever == [(c['NHC'], c['Fecha de Ingreso']) for c in stored
+                             if 'Q38933' in c['síntomas']]
+            assert store.find_notes(desde=datetime(2020, 3, 31)) == [('507316', '31/03/20 15:46:20.668000000')]
+
+    def test_failed_batch(self, tmp_path):
+        with ExtractionStore(str(tmp_path / 'extracciones.sqlite')) as store:
+            with pytest.raises(KeyError):
+                # the second note has no NHC, the whole batch is rolled back
+                store.add_many([register('1', ['Q38933']), {'síntomas': {}}])
+            store.add_many([register('2', ['Q35805']), register('3', ['Q38933'])])
+            assert [list(clues['síntomas']) for (_, clues) in store.read()] == [['Q35805'], ['Q38933']]
+
+    def test_read_pages(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(store_module, 'READ_PAGE', 2)
+        with ExtractionStore(str(tmp_path / 'extracciones.sqlite')) as store:
+            store.add_many([register(str(chn), ['Q38933']) for chn in range(5)])
+            assert [clues['NHC'] for (_, clues) in store.read(after_id=1)] == ['1', '2', '3', '4']
+            notes = store.read()
+            next(notes)
+            # a writer from another thread is not blocked by the open reader
+            writer = threading.Thread(target=store.add, args=(register('5'),))
+            writer.start()
+            writer.join(10)
+            assert not writer.is_alive()
+
+    def test_report(self, tmp_path):
+        store_path = str(tmp_path / 'extracciones.sqlite')
+        state_path = str(tmp_path / 'reporte.npz')
+        with SQLiteSink(store_path) as sink:
+            sink.write(register('1', ['Q38933'], ['Q84263196']))
+            sink.write(register('2', ['Q35805']))
+        report = ReportGenerator(store_path, excels_dir=str(tmp_path), state_path=state_path)
+        assert list(report.df_report['NHC']) == ['1', '2']
+        with SQLiteSink(store_path) as sink:
+            # mined again, replaces the stored note
+            sink.write(register('1', ['Q35805']))
+        report = ReportGenerator(store_path, excels_dir=str(tmp_path), state_path=state_path)
+        assert list(report.df_report['NHC']) == ['1', '2']
+        assert list(report.df_symptoms['fiebre']) == [False, False]
+        assert report.symptom_counts()['tos'] == 2
+        with SQLiteSink(store_path) as sink:
+            # the last note stored, mined again
+            sink.write(register('1', ['Q38933']))
+        report = ReportGenerator(store_path, excels_dir=str(tmp_path), state_path=state_path)
+        assert list(report.df_symptoms['fiebre']) == [True, False]
+        assert report.symptom_counts()['tos'] == 1
+
+
+class TestReportGenerator:
+
+    def test_data_frames(self, tmp_path):
+        with JSONLinesSink(str(tmp_path)) as sink:
+            # Q18343527 and Q21112016 share their canonical name
+            sink.write(register('1', ['Q18343527', 'Q38933'], ['Q84263196']))
+            sink.write(register('2', ['Q35805']))
+            sink.write(register('3', ['Q35805'], ['Q84263196']))
+            # mined again without covid
+            sink.write(register('3', ['Q38933']))
+        report = ReportGenerator(str(tmp_path), excels_dir=str(tmp_path))
+        assert list(report.df_report['NHC']) == ['1', '2', '3']
+        assert list(report.df_symptoms['molestia gastrointestinal']) == [True, False, False]
+        assert list(report.df_symptoms['fiebre']) == [True, False, True]
+        assert list(report.df_symptoms['tos']) == [False, True, False]
+        assert report.df_symptoms.values.sum() == 4
+        # running counts follow the replaced record
+        assert report.symptom_counts().equals(report.df_symptoms.sum(axis=0))
+        report = ReportGenerator(str(tmp_path), excels_dir=str(tmp_path), only_covid=True)
+        assert list(report.df_report['NHC']) == ['1']
+        assert report.df_comorbs.shape == (1, 26)
+
+    def test_incremental(self, tmp_path):
+        mednotes_dir = str(tmp_path / 'extracciones')
+        state = str(tmp_path / 'reporte.npz')
+        with JSONLinesSink(mednotes_dir) as sink:
+            sink.write(register('1', ['Q38933']))
+        report = ReportGenerator(mednotes_dir, excels_dir=str(tmp_path), state_path=state)
+        assert list(report.df_report['NHC']) == ['1']
+        # the next report only reads the new shard
+        with JSONLinesSink(mednotes_dir) as sink:
+            sink.write(register('2', ['Q35805']))
+        report = ReportGenerator(mednotes_dir, excels_dir=str(tmp_path), state_path=state)
+        assert list(report.manifest) == ['extracciones-00000.jsonl', 'extracciones-00001.jsonl']
+        assert list(report.df_report['NHC']) == ['1', '2']
+        assert list(report.df_symptoms['tos']) == [False, True]
+        # a removed extraction rebuilds the state
+        os.remove(os.path.join(mednotes_dir, 'extracciones-00000.jsonl'))
+        report = ReportGenerator(mednotes_dir, excels_dir=str(tmp_path), state_path=state)
+        assert list(report.df_report['NHC']) == ['2']
+
+    def test_outputs(self, tmp_path):
+        from openpyxl import load_workbook
+        with JSONLinesSink(str(tmp_path)) as sink:
+            sink.write(register('1', ['Q38933'], ['Q84263196']))
+            sink.write(register('2', ['Q35805']))
+        report = ReportGenerator(str(tmp_path), excels_dir=str(tmp_path / 'informes'))
+        book = load_workbook(report.to_excel())
+        assert book.sheetnames == ['Concentrado 20200330', 'Evidencia 20200330',
+                                   'síntomas 20200330', 'Comorbilidad 20200330']
+        concentrado = book['Concentrado 20200330']
+        assert concentrado.column_dimensions['C'].width == 30
+        assert [cell.value for cell in concentrado['B']] == ['NHC', '1', '2']
+        assert book['síntomas 20200330']['B2'].value is True
+        from importlib.util import find_spec
+        if not (find_spec('pyarrow') or find_spec('fastparquet')):
+            with pytest.raises(ImportError, match='pip install pyarrow'):
+                report.to_parquet()
+        csvs = report.to_csv()
+        assert [os.path.basename(path).rsplit('_', 1)[1] for path in csvs] == [
+            'concentrado.csv', 'evidencia.csv', 'sintomas.csv', 'comorbilidad.csv']
+
+    def test_date_range(self, tmp_path):
+        registers = [register('1', ['Q38933'], date='28/03/20'),
+                     register('2', ['Q35805'], date='30/03/20'),
+                     register('3', ['Q38933'], date='01/04/20'),
+                     register('4', ['Q38933'], date='03/04/20')]
+        with JSONLinesSink(str(tmp_path / 'json')) as sink:
+            for medical_register in registers:
+                sink.write(medical_register)
+        with SQLiteSink(str(tmp_path / 'extracciones.sqlite')) as sink:
+            for medical_register in registers:
+                sink.write(medical_register)
+        for mednotes in ('json', 'extracciones.sqlite'):
+            report = ReportGenerator(str(tmp_path / mednotes), excels_dir=str(tmp_path),
+                                     state_path=str(tmp_path / (mednotes+'.npz')),
+                                     desde=datetime(2020, 3, 29), hasta=datetime(2020, 4, 2))
+            assert list(report.df_report['NHC']) == ['2', '3']
+            assert report.symptom_counts()['fiebre'] == 1
+            assert report.sheets()[3][1] == 'Comorbilidad 20200329-20200402'
+
+
+class TestAmchartsGenerator:
+
+    def test_pictorial_stacked_chart(self):
+        import pandas as pd
+        counts = pd.Series([1, 5, 3, 5, 0], index=['a', 'b', 'c', 'd', 'e'])
+        chart = AmchartsGenerator().pictorial_stacked_chart(counts, 3)
+        assert chart == [{'name': 'b', 'value': 5}, {'name': 'd', 'value': 5},
+                         {'name': 'c', 'value': 3}]
+        assert AmchartsGenerator().pictorial_stacked_chart(counts, 0) == []
+
+    def test_population_pyramid(self):
+        admissions = {datetime(2020, 3, 30): 2, datetime(2020, 4, 1): 1}
+        discharges = {datetime(2020, 3, 31): 4}
+        chart = AmchartsGenerator().population_pyramid(admissions, discharges)
+        # the last day is included
+        assert [day['fecha'] for day in chart] == ['30/03/20', '31/03/20', '01/04/20']
+        assert [(day['ingresos'], day['egresos']) for day in chart] == [(2, 0), (0, 4), (1, 0)]
+
+class TestMiningCache:
+
+    def test_memoized(self, tmp_path):
+        path = str(tmp_path / 'cache.sqlite')
+        cache = MiningCache(size=2, path=path)
+        clues = cache.mine('paciente con fiebre y tos', {'NHC': '1'})
+        again = cache.mine('paciente con fiebre y tos', {'NHC': '2'})
+        assert again['NHC'] == '2'
+        assert again['síntomas'] == clues['síntomas']
+        assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+        # only the very same note is a hit
+        cache.mine('Paciente con FIEBRE y tos')
+        assert cache.stats()['misses'] == 2
+        # the SQLite tier outlives the process cache
+        cache = MiningCache(size=2, path=path)
+        cache.mine('paciente con fiebre y tos')
+        assert cache.stats()['hits'] == 1
+
+    def test_mine_batch(self):
+        notes = [('fiebre', {'NHC': str(n)}) for n in range(4)] + [('tos', {'NHC': '4'})]
+        cache = MiningCache()
+        batch = list(MedNotesMiner.mine_batch(notes, workers=2, cache=cache))
+        assert [clues['NHC'] for clues in batch] == ['0', '1', '2', '3', '4']
+        assert list(batch[4]['síntomas']) == ['Q35805']
+        # the copies of the same note are mined once
+        assert (cache.stats()['hits'], cache.stats()['misses']) == (3, 2)
+        assert batch[1]['síntomas'] == batch[0]['síntomas']
+        batch = list(MedNotesMiner.mine_batch(notes, workers=2, cache=cache))
+        assert (cache.stats()['hits'], cache.stats()['misses']) == (8, 2)
@@ -8,10 +8,13 @@
 
 import os
 import re
+import csv
+import threading
+from collections import deque
 from os.path import (join, exists, dirname, abspath)
 from pathlib import Path
-from shutil import rmtree
-import pandas as pd 
+from c19mining.gazetteer import (Gazetteer, CodeTable)
+from c19mining.negation import NegationDetector
 from datetime import datetime
 
 # all paths to data resources are relative to the project home
@@ -29,6 +32,13 @@ CANONICAL_COMORBS = 'resources/canonical_comorbilidades.csv'
 DRUGS_DATA = 'resources/drogas.csv'
 COVID19_SAMPLING = 'resources/muestras.txt'
 COVID19_DECEASE = 'resources/decesos.txt'
+NEGATION_TRIGGERS = 'resources/negaciones.csv'
+# categories of the clues mined by MedNotesMiner, their index is their id
+CLUE_CATEGORIES = ['COVID-19', 'síntomas', 'muestreos', 'defunciones',
+                   'comorbilidades', 'medicamentos']
+# clues that are just a list of mentions, without codes and never negated
+LISTED_CLUES = ('muestreos', 'defunciones')
+WIKIDATA_URL = 'https://www.wikidata.org/wiki/'
 
 # Data
 # UPLOADS DIRS
@@ -83,6 +93,20 @@ canonical_comorb_names = {
     'Q15787':   'vih'
 }
 
+# formats of the day in INSERT_DATE, tried in order
+DAY_FORMATS = ['%d/%m/%y', '%d/%m/%Y', '%Y-%m-%d']
+
+def parse_day(timestamp):
+    """datetime of the day of a timestamp like '30/03/20 15:46:20.668' or
+    '1/4/2020 09:10', None if it is not in any of DAY_FORMATS"""
+    day = timestamp.strip().split(' ', 1)[0] if timestamp else ''
+    for day_format in DAY_FORMATS:
+        try:
+            return datetime.strptime(day, day_format)
+        except ValueError:
+            pass
+    return None
+
 def get_time():
     """creates datestamp """
     now = datetime.now()
@@ -115,28 +139,16 @@ def uploads_dir():
     return path
 
 def canonical_symptoms_order():
-    csymptoms_path = join(HOME, CANONICAL_SYMPTOMS)
-    with open(csymptoms_path, 'r') as f:
-        canonical_order = [l.split('\t')[0] for l in f.readlines()]
-    return canonical_order
+    return _canonical_registry.get('symptoms')[0]
 
 def canonical_symptoms_name():
-    csymptoms_path = join(HOME, CANONICAL_SYMPTOMS)
-    with open(csymptoms_path, 'r') as f:
-        canonical_names = {l.split('\t')[0]: (l.split('\t')[1]).strip('\n') for l in f.readlines()}
-    return canonical_names
+    return _canonical_registry.get('symptoms')[1]
 
 def canonical_comorbs_order():
-    resource_path = join(HOME, CANONICAL_COMORBS)
-    with open(resource_path, 'r') as f:
-        canonical_order = [l.split('\t')[0] for l in f.readlines()]
-    return canonical_order
+    return _canonical_registry.get('comorbs')[0]
 
 def canonical_comorbs_name():
-    resource_path = join(HOME, CANONICAL_COMORBS)
-    with open(resource_path, 'r') as f:
-        canonical_names = {l.split('\t')[0]: (l.split('\t')[1]).strip('\n') for l in f.readlines()}
-    return canonical_names
+    return _canonical_registry.get('comorbs')[1]
 
 def covid19():
     symptoms_path = join(HOME, COVID19_DATA)
@@ -256,13 +268,22 @@ def load_txt(filepath):
         lines = [l.replace('\n', '') for l in f.readlines()]
     return lines
 
+def load_tsv(filepath):
+    """rows of a tab separated file with header as dicts"""
+    with open(filepath, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f, delimiter='\t'))
+
 def load_csv(filepath):
-    df = pd.read_csv(filepath, sep='\t')
-    return list(zip(df.id, df.name))
+    return [(row['id'], row['name']) for row in load_tsv(filepath)]
+
+def load_canonical(filepath):
+    """(codes in order, {code: canonical name}) of a canonical names file"""
+    with open(filepath, encoding='utf-8') as f:
+        rows = [l.rstrip('\n').split('\t') for l in f]
+    return ([row[0] for row in rows], {row[0]: row[1] for row in rows})
 
 def load_names_dict(filepath):
-    df = pd.read_csv(filepath, sep='\t')
-    d = dict({name:code for name, code in list(zip(df.name, df.id))})
+    d = dict({name:code for (code, name) in load_csv(filepath)})
     return d
 
 def mkdir(out, name):
@@ -271,10 +292,11 @@ def mkdir(out, name):
         os.makedirs(create_dir)
     return create_dir
 
-def list2contextregex(path, context_size=6):
+def list2contextregex(path, context_size=5):
     with open(path) as f:
         joined = '|'.join([l.strip('\n') for l in f.readlines()])
-    regex = r'((\w+\W+){0,5}('+joined+r')(\W+\w+){0,5})'
+    window = '{{0,{}}}'.format(context_size)
+    regex = r'((\w+\W+)'+window+'('+joined+r')(\W+\w+)'+window+')'
     compiled = re.compile(regex)
     return compiled
 
@@ -284,15 +306,59 @@ def csv2regex(path):
     compiled = re.compile(regex)
     return compiled
 
-def csv2contextregex(path, context_size=6):
+def csv2contextregex(path, context_size=5):
     tuple_list = load_csv(path)
     joined = '|'.join([r'\b'+name+r'\b' for (_, name) in tuple_list])
-    regex = r'((\w+\W+){0,5}('+joined+r')(\W+\w+){0,5})'
+    window = '{{0,{}}}'.format(context_size)
+    regex = r'((\w+\W+)'+window+'('+joined+r')(\W+\w+)'+window+')'
     compiled = re.compile(regex)
     return compiled
 
+def csv2gazetteer(*paths):
+    gazetteer = Gazetteer()
+    for path in paths:
+        gazetteer.update(load_csv(path))
+    return gazetteer
+
+def list2gazetteer(*paths):
+    gazetteer = Gazetteer()
+    for path in paths:
+        gazetteer.update([(None, name) for name in load_txt(path)])
+    return gazetteer
+
+def clues_gazetteer(covid, symptoms, morbidities, drugs, sampling, decease):
+    """one gazetteer for all the clues categories of MedNotesMiner, entries
+    are (code id, name) under the index of their category in CLUE_CATEGORIES"""
+    codes = CodeTable()
+    gazetteer = Gazetteer(codes=codes)
+    for (category, entries) in [('COVID-19', load_csv(covid)),
+                                ('síntomas', load_csv(symptoms)),
+                                ('comorbilidades', load_csv(morbidities)),
+                                ('medicamentos', load_csv(drugs)),
+                                ('muestreos', [(None, name) for name in load_txt(sampling)]),
+                                ('defunciones', [(None, name) for name in load_txt(decease)])]:
+        gazetteer.update([(codes.intern(code), name) for (code, name) in entries],
+                         CLUE_CATEGORIES.index(category))
+    return gazetteer
+
+def csv2negations(path):
+    rules = [(row['trigger'], row['tipo'], int(row['alcance']), row['categorias'].split(','))
+             for row in load_tsv(path)]
+    return NegationDetector(rules)
+
+def entities_gazetteer(covid, morbidities, symptoms, drugs):
+    """one gazetteer for the OpenNLP entity types"""
+    gazetteer = Gazetteer()
+    # there is no wikidata diseases resource, covid and comorbidities stand in
+    gazetteer.update(load_csv(covid), 'Desease')
+    gazetteer.update(load_csv(morbidities), 'Desease')
+    gazetteer.update(load_csv(symptoms), 'Symptom')
+    gazetteer.update(load_csv(drugs), 'Drug')
+    return gazetteer
+
 def explore_dir(explore_dir, yield_extension='txt'):
     for root, directory, files in os.walk(explore_dir, topdown=True):
+            directory.sort(key=natural_keys)
             for file in sorted(files, key=natural_keys):
                 if file.endswith(yield_extension):
                     full_path = join(root, file)
@@ -314,6 +380,166 @@ def allowed_file(filename):
 def allowed_xml_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ['xml','XML']
 
+def pool_imap(function, arguments, workers=None, max_pending=None,
+              initializer=None, initargs=(), return_exceptions=False):
+    """Call function with each tuple of arguments in a pool of processes.
+
+    Results are yielded in input order and at most max_pending calls (four
+    per worker by default) are in flight, so arguments can be a lazy
+    iterable of any length. workers=1 runs in the calling process.
+    With return_exceptions a failed call yields its exception instead of
+    stopping the whole map. A Future among the arguments, e.g. a result
+    known beforehand, is not called but yielded in its turn.
+
+    Workers are started by a fork server, or spawned where there is none,
+    never forked from the caller: forking a threaded server copies locks
+    that other threads may hold at that moment.
+    """
+    from concurrent.futures import Future
+    workers = workers if workers else os.cpu_count()
+    if workers == 1:
+        if initializer:
+            initializer(*initargs)
+        for args in arguments:
+            try:
+                yield args.result() if isinstance(args, Future) else function(*args)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                yield e
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    def result(future):
+        try:
+            return future.result()
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    max_pending = max_pending if max_pending else 4 * workers
+    pending = deque()
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs,
+                             mp_context=multiprocessing.get_context(start_method)) as executor:
+        try:
+            for args in arguments:
+                pending.append(args if isinstance(args, Future)
+                               else executor.submit(function, *args))
+                if len(pending) >= max_pending:
+                    yield result(pending.popleft())
+            while pending:
+                yield result(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+
 def log_file():
     log_path = join(HOME, LOG_DIRNAME, 'error.log')
     return log_path
+
+
+# Lexicons shared by every miner in the process:
+# name -> (resource or tuple of resources, loader)
+LEXICON_RESOURCES = {
+    'clues_gz':       ((COVID19_DATA, WIKI_SYMPTOMS_DATA, COVID19_MORBIDITIES_DATA,
+                        DRUGS_DATA, COVID19_SAMPLING, COVID19_DECEASE), clues_gazetteer),
+    'negations':      (NEGATION_TRIGGERS, csv2negations),
+    'entities_gz':    ((COVID19_DATA, COVID19_MORBIDITIES_DATA, WIKI_SYMPTOMS_DATA,
+                        DRUGS_DATA), entities_gazetteer),
+}
+
+
+class LexiconRegistry(object):
+    """Thread-safe cache of loaded lexicons.
+
+    Each lexicon is built once from its resource file and rebuilt only when
+    the file modification time changes.
+    """
+    def __init__(self, resources=None):
+        super(LexiconRegistry, self).__init__()
+        self.resources = resources if resources else LEXICON_RESOURCES
+        self.lock = threading.RLock()
+        self.cache = dict()
+        # path: ((size, mtime), content hash) of the resources hashed
+        self.digests = dict()
+
+    def get(self, name):
+        """return the lexicon called name, loading it if needed"""
+        (resources, loader) = self.resources[name]
+        if isinstance(resources, str):
+            resources = (resources,)
+        paths = [join(HOME, resource) for resource in resources]
+        try:
+            mtime = tuple(os.stat(path).st_mtime_ns for path in paths)
+        except FileNotFoundError as e:
+            raise FileNotFoundError('Missing resource for lexicon "{}": {}'.format(
+                name, e.filename)) from e
+        with self.lock:
+            cached = self.cache.get(name)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            lexicon = loader(*paths)
+            self.cache[name] = (mtime, lexicon)
+        return lexicon
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def version(self):
+        """short hash of the contents of every resource, it changes whenever
+        any lexicon changes but not on a checkout or copy of the same files.
+        A resource is only read again when its size or mtime change"""
+        import hashlib
+        stamps = []
+        for name in sorted(self.resources):
+            (resources, _) = self.resources[name]
+            if isinstance(resources, str):
+                resources = (resources,)
+            for resource in resources:
+                stamps.append('{}:{}:{}'.format(name, resource, self.digest(join(HOME, resource))))
+        return hashlib.blake2b('\n'.join(stamps).encode('utf-8'), digest_size=8).hexdigest()
+
+    def digest(self, path):
+        import hashlib
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.digests.get(path)
+            if cached and cached[0] == stamp:
+                return cached[1]
+            with open(path, 'rb') as f:
+                digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+            self.digests[path] = (stamp, digest)
+        return digest
+
+    def preload(self):
+        """load every known lexicon, e.g. before forking workers"""
+        for name in self.resources:
+            self.get(name)
+
+    def loaded(self):
+        """True if every known lexicon was loaded at least once"""
+        with self.lock:
+            return all(name in self.cache for name in self.resources)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+_lexicon_registry = LexiconRegistry()
+
+def lexicon_registry():
+    """process-wide lexicon registry"""
+    return _lexicon_registry
+
+# canonical names of the reports, apart from the lexicons so editing them
+# doesn't change the lexicons version
+CANONICAL_RESOURCES = {
+    'symptoms': (CANONICAL_SYMPTOMS, load_canonical),
+    'comorbs':  (CANONICAL_COMORBS, load_canonical),
+}
+_canonical_registry = LexiconRegistry(CANONICAL_RESOURCES)